@@ -0,0 +1,258 @@
+import math
+from enum import StrEnum
+from typing import Any
+
+import faiss  # type:ignore
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from exact_vectors import ExactVectorStore
+from logger import logger
+from settings import settings
+
+# IVF needs roughly this many training points per centroid for stable clustering.
+IVF_TRAINING_POINTS_PER_CENTROID = 39
+# Dimensions covered by each product quantization sub-quantizer when PQ_M is not set,
+# with 8-bit codes a 1024-d float32 vector (4 KiB) becomes 128 bytes.
+PQ_DIMENSIONS_PER_SUBQUANTIZER = 8
+
+
+class IndexType(StrEnum):
+    AUTO = "auto"
+    FLAT = "flat"
+    HNSW = "hnsw"
+    IVF = "ivf"
+
+
+class Compression(StrEnum):
+    NONE = "none"
+    FP16 = "fp16"
+    INT8 = "int8"
+    PQ = "pq"
+
+
+SCALAR_QUANTIZER_TYPES = {
+    Compression.FP16: faiss.ScalarQuantizer.QT_fp16,
+    Compression.INT8: faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def choose_index_type(requested: IndexType, chunk_count: int) -> IndexType:
+    if requested != IndexType.AUTO:
+        return requested
+    if chunk_count < settings.indexing_settings.HNSW_MIN_CHUNKS:
+        return IndexType.FLAT
+    if chunk_count < settings.indexing_settings.IVF_MIN_CHUNKS:
+        return IndexType.HNSW
+    return IndexType.IVF
+
+
+def choose_compression(requested: Compression, chunk_count: int) -> Compression:
+    # PQ codebooks need training data for every centroid, small stores use int8 instead.
+    pq_centroids = 2**settings.indexing_settings.PQ_NBITS
+    if (
+        requested == Compression.PQ
+        and chunk_count < IVF_TRAINING_POINTS_PER_CENTROID * pq_centroids
+    ):
+        return Compression.INT8
+    return requested
+
+
+def compression_of(index: Any) -> Compression:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        codec = faiss.downcast_index(ivf)
+    elif isinstance(index, faiss.IndexHNSW):
+        codec = faiss.downcast_index(index.storage)
+    else:
+        codec = index
+    if isinstance(codec, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return Compression.PQ
+    if isinstance(codec, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        if codec.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+            return Compression.FP16
+        return Compression.INT8
+    return Compression.NONE
+
+
+def pq_subquantizers(dimension: int) -> int:
+    # The number of sub-quantizers has to divide the dimension.
+    configured = settings.indexing_settings.PQ_M
+    if configured and dimension % configured == 0:
+        return configured
+    m = max(1, dimension // PQ_DIMENSIONS_PER_SUBQUANTIZER)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def index_type_of(index: Any) -> IndexType:
+    if faiss.try_extract_index_ivf(index) is not None:
+        return IndexType.IVF
+    if isinstance(index, faiss.IndexHNSW):
+        return IndexType.HNSW
+    return IndexType.FLAT
+
+
+def default_index_params(index_type: IndexType, chunk_count: int) -> dict[str, int]:
+    if index_type == IndexType.HNSW:
+        return {
+            "M": settings.indexing_settings.HNSW_M,
+            "efConstruction": settings.indexing_settings.HNSW_EF_CONSTRUCTION,
+            "efSearch": settings.indexing_settings.HNSW_EF_SEARCH,
+        }
+    if index_type == IndexType.IVF:
+        nlist = settings.indexing_settings.IVF_NLIST or int(4 * math.sqrt(chunk_count))
+        # Never ask for more centroids than the training data can support.
+        nlist = max(1, min(nlist, chunk_count // IVF_TRAINING_POINTS_PER_CENTROID))
+        return {"nlist": nlist, "nprobe": settings.indexing_settings.IVF_NPROBE}
+    return {}
+
+
+def build_index(
+    index_type: IndexType,
+    vectors: np.ndarray,
+    params: dict[str, int],
+    compression: Compression = Compression.NONE,
+) -> Any:
+    """
+    Builds an index of the given type over `vectors`, storing them as float32 or
+    compressed with a scalar quantizer (fp16/int8) or product quantization, and trains
+    it first if needed.
+    """
+    dimension = vectors.shape[1]
+    nbits = settings.indexing_settings.PQ_NBITS
+    if index_type == IndexType.HNSW:
+        if compression == Compression.PQ:
+            index = faiss.IndexHNSWPQ(
+                dimension, pq_subquantizers(dimension), params["M"], nbits
+            )
+        elif compression in SCALAR_QUANTIZER_TYPES:
+            index = faiss.IndexHNSWSQ(
+                dimension, SCALAR_QUANTIZER_TYPES[compression], params["M"]
+            )
+        else:
+            index = faiss.IndexHNSWFlat(dimension, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    elif index_type == IndexType.IVF:
+        quantizer = faiss.IndexFlatL2(dimension)
+        if compression == Compression.PQ:
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                dimension,
+                params["nlist"],
+                pq_subquantizers(dimension),
+                nbits,
+            )
+        elif compression in SCALAR_QUANTIZER_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer,
+                dimension,
+                params["nlist"],
+                SCALAR_QUANTIZER_TYPES[compression],
+            )
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"])
+    elif compression == Compression.PQ:
+        index = faiss.IndexPQ(dimension, pq_subquantizers(dimension), nbits)
+    elif compression in SCALAR_QUANTIZER_TYPES:
+        index = faiss.IndexScalarQuantizer(
+            dimension, SCALAR_QUANTIZER_TYPES[compression]
+        )
+    else:
+        index = faiss.IndexFlatL2(dimension)
+    if not index.is_trained:
+        index.train(vectors)
+    if len(vectors):
+        index.add(vectors)
+    set_search_params(index, params)
+    return index
+
+
+def set_search_params(index: Any, params: dict[str, int]) -> None:
+    parameter_space = faiss.ParameterSpace()
+    if "nprobe" in params and faiss.try_extract_index_ivf(index) is not None:
+        parameter_space.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "efSearch" in params and isinstance(index, faiss.IndexHNSW):
+        parameter_space.set_index_parameter(index, "efSearch", params["efSearch"])
+
+
+def reconstruct_all(index: Any) -> np.ndarray:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map(True)
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    finally:
+        if ivf is not None:
+            ivf.make_direct_map(False)
+
+
+def stored_vectors(store: FAISS, exact: ExactVectorStore | None = None) -> np.ndarray:
+    """
+    All vectors of the store in position order, read from the exact vector store when it
+    holds every chunk so compressed indexes are rebuilt from full-precision vectors.
+    """
+    if exact is not None:
+        doc_ids = [doc_id for _, doc_id in sorted(store.index_to_docstore_id.items())]
+        found = exact.get_many(doc_ids)
+        if len(found) == len(doc_ids):
+            return np.stack([found[doc_id] for doc_id in doc_ids])
+    return reconstruct_all(store.index)
+
+
+def rebuild_index(
+    store: FAISS,
+    index_type: IndexType,
+    params: dict[str, int],
+    compression: Compression = Compression.NONE,
+    exact: ExactVectorStore | None = None,
+) -> None:
+    """Re-creates the store's index as `index_type`, positions stay the same."""
+    vectors = stored_vectors(store, exact)
+    logger.info(
+        f"Rebuilding {store.index.ntotal} vectors as a {index_type} index "
+        f"({compression} compression)"
+    )
+    store.index = build_index(index_type, vectors, params, compression)
+
+
+def remove_vectors(
+    store: FAISS,
+    ids: list[str],
+    params: dict[str, int],
+    exact: ExactVectorStore | None = None,
+) -> None:
+    """
+    Deletes chunks from the store. Only flat indexes renumber their positions when vectors
+    are removed in place. HNSW graphs cannot remove vectors at all and IVF indexes keep
+    the old labels, so for both the remaining vectors are added to a fresh index instead.
+    """
+    index_type = index_type_of(store.index)
+    if index_type == IndexType.FLAT:
+        store.delete(ids)
+        return
+
+    doomed = set(ids)
+    keep = [
+        position
+        for position, doc_id in sorted(store.index_to_docstore_id.items())
+        if doc_id not in doomed
+    ]
+    vectors = stored_vectors(store, exact)[keep]
+    store.docstore.delete(ids)  # type:ignore
+    store.index_to_docstore_id = {
+        new_position: store.index_to_docstore_id[old_position]
+        for new_position, old_position in enumerate(keep)
+    }
+    if index_type == IndexType.HNSW:
+        store.index = build_index(
+            IndexType.HNSW, vectors, params, compression_of(store.index)
+        )
+        return
+    # The trained centroids and codebooks still fit the data, only the lists are refilled.
+    index = faiss.clone_index(store.index)
+    index.reset()
+    if len(vectors):
+        index.add(vectors)
+    store.index = index
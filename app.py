@@ -1,5 +1,6 @@
 import streamlit as st  # type:ignore
 import requests  # type:ignore
+import json
 
 BASE_URL = "http://localhost:8000"
 
@@ -25,14 +26,47 @@ st.header("2. Index Files")
 if st.button("Index Files"):
     params = {"knowledge_name": knowledge_name, "user_id": user_id}
     res = requests.post(f"{BASE_URL}/rag/index-file", params=params)
+    job = res.json()
+    st.session_state["index_job_id"] = job.get("job_id")
+    st.write(job)
+
+if st.session_state.get("index_job_id") and st.button("Refresh Index Status"):
+    job_id = st.session_state["index_job_id"]
+    res = requests.get(f"{BASE_URL}/rag/index-jobs/{job_id}")
     st.write(res.json())
 
 st.header("3. Ask the Knowledge Base")
+ask_knowledge_names = st.text_input("Knowledge Names (comma separated)", knowledge_name)
 query = st.text_area("Enter your question")
 if st.button("Ask"):
     if query.strip():
-        params = {"knowledge_name": knowledge_name, "user_id": user_id, "query": query}
-        res = requests.post(f"{BASE_URL}/rag/ask", params=params)
-        st.write(res.text)
+        names = [n.strip() for n in ask_knowledge_names.split(",") if n.strip()]
+        params = {"knowledge_name": names, "user_id": user_id, "query": query}
+        status = st.status("Thinking...")
+        placeholder = st.empty()
+        answer = ""
+        with requests.post(
+            f"{BASE_URL}/rag/ask/stream", params=params, stream=True
+        ) as res:
+            # Server-Sent Events, every event is a single `data:` line of JSON.
+            for line in res.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: ") :])
+                if event["event"] == "node":
+                    status.write(f"{event['node']} ({event['elapsed_ms']} ms)")
+                elif event["event"] == "token":
+                    answer += event["text"]
+                    placeholder.markdown(answer)
+                elif event["event"] == "answer":
+                    placeholder.markdown(event["answer"])
+                    status.update(
+                        label=f"First token after {event['first_token_ms']} ms, "
+                        f"done after {event['total_ms']} ms",
+                        state="complete",
+                    )
+                elif event["event"] == "error":
+                    status.update(label="Failed", state="error")
+                    st.error(event["detail"])
     else:
         st.error("Please enter a query.")
@@ -1,7 +1,6 @@
 from typing import Annotated
 
 from enum import StrEnum
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
 from langgraph.graph.message import add_messages
 
@@ -17,12 +16,15 @@ from tools import (
     tool_doc_related,
 )
 from prompts import ASK_AGENT_PROMPT
+from context import format_docs
+from metrics import observe_llm_usage
 from backend import get_sratchpad_from_messages
-from settings import settings
+from llm import get_llm
+from functools import lru_cache
 
 
 class AskState(BaseModel):
-    knowledge_name: str
+    knowledge_names: list[str]
     user_id: str
     question: str
     docs: list[Document] | None = None
@@ -55,24 +57,16 @@ async def post_processor_ask(state: AskState):
 
 
 async def ask_agent(state: AskState):
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
-    )
-    if model is None:
-        raise RuntimeError("Model not available ")
-
     tools = [summarizer, doc_related]
 
-    model = model.bind_tools(tools)  # type:ignore
+    model = get_llm("ask_agent").bind_tools(tools)
     scratchpad = await get_sratchpad_from_messages(state.messages)
 
     prompt = ASK_AGENT_PROMPT.format(
-        question=state.question, scratchpad=scratchpad, docs=state.docs
+        question=state.question, scratchpad=scratchpad, docs=format_docs(state.docs)
     )
     response = await model.ainvoke(prompt)
+    observe_llm_usage("ask_agent", prompt, response)
     return {
         "agent_response": response,
         "messages": [response],
@@ -107,8 +101,8 @@ def build_ask_graph() -> CompiledStateGraph:
             ):
                 logger.info("Summary tool triggered")
                 last_message.tool_calls[0]["args"][  # type:ignore
-                    "knowledge_name"
-                ] = state.knowledge_name
+                    "knowledge_names"
+                ] = state.knowledge_names
                 last_message.tool_calls[0]["args"][  # type:ignore
                     "user_id"
                 ] = state.user_id
@@ -118,9 +112,6 @@ def build_ask_graph() -> CompiledStateGraph:
                 == doc_related.name
             ):
                 logger.info("Doc related tool triggered")
-                last_message.tool_calls[0]["args"][  # type:ignore
-                    "docs"
-                ] = state.docs
                 return AskSteps.DOC_RELATED_QUERY  # tool
 
     workflow.add_conditional_edges(AskSteps.ASK_AGENT, determine_router)
@@ -129,3 +120,9 @@ def build_ask_graph() -> CompiledStateGraph:
     workflow.add_edge(AskSteps.POST_PROCESSOR, AskSteps.ASK_AGENT)
 
     return workflow.compile()
+
+
+@lru_cache(maxsize=1)
+def get_ask_graph() -> CompiledStateGraph:
+    """`build_ask_graph` compiled once per process, it holds no per-request state."""
+    return build_ask_graph()
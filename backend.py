@@ -1,32 +1,69 @@
 from fastapi import UploadFile
+import asyncio
 import os
+import time
+from collections.abc import AsyncIterator, Callable
 from typing import Any
-import fitz  # type:ignore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AIMessageChunk, AnyMessage
 
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.document import Document
+from embeddings import EmbeddingEngine, QueryEmbeddingBatcher
 from logger import logger
 from langgraph.graph.state import CompiledStateGraph
 from langchain_core.runnables.config import RunnableConfig
 from prompts import REFOMRULATE_PROMPT
 from memory import Memory
-from main_graph import build_graph, State
+from main_graph import build_graph, State, Steps
+from fast_graph import FastSteps, GraphMode, build_fast_graph
 from settings import settings
+from indexing import MANIFEST_FILE_NAME, index_knowledge
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from vectorstores import VectorStoreCache
+from retrieval_cache import RetrievalCache
+from history import (
+    build_scratchpad,
+    is_self_contained,
+    load_tokenizer,
+    update_history_summary,
+)
+from llm import get_llm
+from metrics import metrics
+from summaries import SUMMARIES_FILE_NAME, refresh_summaries
+from text_store import TEXT_STORE_FILE_NAME, TextStore
+from retrieval import Speculation, retrieve_documents
 
 KNOWLEDGE_RAG_DIR = "knowledges"
-EMBED_MODEL = HuggingFaceEmbeddings(
-    model_name="Qwen/Qwen3-Embedding-0.6B",
-    model_kwargs={"trust_remote_code": True, "device": "cuda"},
-    encode_kwargs={
-        "batch_size": 4,
-        "convert_to_tensor": False,
-    },
+EMBED_MODEL = EmbeddingEngine(
+    model_name=settings.embedding_settings.MODEL_NAME,
+    device=settings.embedding_settings.DEVICE,
+    num_threads=settings.embedding_settings.NUM_THREADS,
+    max_batch_size=settings.embedding_settings.MAX_BATCH_SIZE,
+    memory_budget_mb=settings.embedding_settings.MEMORY_BUDGET_MB,
+)
+QUERY_EMBEDDER = QueryEmbeddingBatcher(
+    embeddings=EMBED_MODEL,
+    max_wait_ms=settings.embedding_settings.QUERY_BATCH_WAIT_MS,
+    max_batch_size=settings.embedding_settings.QUERY_MAX_BATCH_SIZE,
+    cache_entries=settings.embedding_settings.QUERY_CACHE_ENTRIES,
+)
+VECTORSTORE_CACHE = VectorStoreCache(
+    max_bytes=settings.retrieval_settings.VECTORSTORE_CACHE_MAX_BYTES
+)
+RETRIEVAL_CACHE = RetrievalCache(
+    threshold=settings.retrieval_settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=settings.retrieval_settings.SEMANTIC_CACHE_TTL_SECONDS,
+    max_entries=settings.retrieval_settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    max_per_knowledge=settings.retrieval_settings.SEMANTIC_CACHE_MAX_PER_KNOWLEDGE,
+)
+EMBEDDING_CACHE = EmbeddingCache(
+    path=settings.embedding_settings.CACHE_PATH,
+    max_bytes=settings.embedding_settings.CACHE_MAX_BYTES,
+)
+INDEX_EMBED_MODEL = CachedEmbeddings(
+    embeddings=EMBED_MODEL,
+    cache=EMBEDDING_CACHE,
+    model_name=settings.embedding_settings.MODEL_NAME,
 )
 
 
@@ -39,6 +76,24 @@ def get_docs_path(knowledge_name: str, user_id: str) -> str:
     )
 
 
+def get_summaries_path(knowledge_name: str, user_id: str) -> str:
+    return os.path.join(
+        KNOWLEDGE_RAG_DIR,
+        user_id,
+        knowledge_name,
+        SUMMARIES_FILE_NAME,
+    )
+
+
+def get_text_store_path(knowledge_name: str, user_id: str) -> str:
+    return os.path.join(
+        KNOWLEDGE_RAG_DIR,
+        user_id,
+        knowledge_name,
+        TEXT_STORE_FILE_NAME,
+    )
+
+
 def get_vs_path(knowledge_name: str, user_id: str) -> str:
     return os.path.join(
         KNOWLEDGE_RAG_DIR,
@@ -48,6 +103,15 @@ def get_vs_path(knowledge_name: str, user_id: str) -> str:
     )
 
 
+def get_manifest_path(knowledge_name: str, user_id: str) -> str:
+    return os.path.join(
+        KNOWLEDGE_RAG_DIR,
+        user_id,
+        knowledge_name,
+        MANIFEST_FILE_NAME,
+    )
+
+
 async def save_uploaded_file(
     knowledge_name: str, file: UploadFile, user_id: str
 ) -> tuple[str, bool]:
@@ -62,109 +126,350 @@ async def save_uploaded_file(
         file_location = os.path.join(docs_path, filename)
         with open(file_location, "wb") as f:
             f.write(await file.read())
+        # The text of a replaced file is stale, the next index run extracts it again.
+        store = TextStore(
+            get_text_store_path(knowledge_name=knowledge_name, user_id=user_id)
+        )
+        try:
+            store.remove([filename])
+        finally:
+            store.close()
         return filename, True
     except Exception as e:
         logger.error(f"Failed to upload {filename}: {e}")
         return filename, False
 
 
-async def index_all_pdfs(knowledge_name: str, user_id: str) -> dict[str, Any]:
-    docs_path = get_docs_path(knowledge_name=knowledge_name, user_id=user_id)
+async def index_all_pdfs(
+    knowledge_name: str,
+    user_id: str,
+    on_progress: Callable[[dict[str, Any]], None] | None = None,
+    index_type: str | None = None,
+    compression: str | None = None,
+) -> dict[str, Any]:
+    # Embedding and FAISS writes are CPU bound, keep them off the event loop.
+    result = await asyncio.to_thread(
+        index_knowledge,
+        docs_path=get_docs_path(knowledge_name=knowledge_name, user_id=user_id),
+        vs_path=get_vs_path(knowledge_name=knowledge_name, user_id=user_id),
+        manifest_path=get_manifest_path(knowledge_name=knowledge_name, user_id=user_id),
+        embeddings=INDEX_EMBED_MODEL,
+        on_progress=on_progress,
+        index_type=index_type,
+        compression=compression,
+        text_store_path=get_text_store_path(
+            knowledge_name=knowledge_name, user_id=user_id
+        ),
+    )
+    VECTORSTORE_CACHE.invalidate((user_id, knowledge_name))
+    RETRIEVAL_CACHE.invalidate((user_id, knowledge_name))
 
-    all_files = os.listdir(docs_path)
-    pdf_files = [f for f in all_files if f.lower().endswith(".pdf")]
+    if result.get("success") and settings.summary_settings.SUMMARIZE_ON_INDEX:
+        # Summaries are an optimisation for summary questions, indexing succeeds
+        # without them and the summarizer tool fills any gaps on demand.
+        try:
+            result["summaries"] = await refresh_summaries(
+                docs_path=get_docs_path(knowledge_name=knowledge_name, user_id=user_id),
+                summaries_path=get_summaries_path(
+                    knowledge_name=knowledge_name, user_id=user_id
+                ),
+                text_store_path=get_text_store_path(
+                    knowledge_name=knowledge_name, user_id=user_id
+                ),
+            )
+        except Exception as e:
+            logger.error(f"Summaries failed for {knowledge_name}: {e}")
+            result["summaries"] = {"error": str(e)}
+    return result
 
-    if not pdf_files:
-        return {"success": False, "message": "No PDF files found."}
 
-    all_pages = []
+def reformulation_skip_reason(state: State) -> str | None:
+    if not state.messages:
+        return "first_turn"
+    if settings.retrieval_settings.SKIP_SELF_CONTAINED_REFORMULATION and (
+        is_self_contained(state.question)
+    ):
+        return "self_contained"
+    return None
 
-    for pdf in pdf_files:
-        pdf_full_path = os.path.join(docs_path, pdf)
 
-        try:
-            doc = fitz.open(pdf_full_path)
-        except Exception as e:
-            logger.error(f"Error opening {pdf}: {e}")
-            continue
+async def skip_reformulation(state: State, reason: str):
+    # No LLM call on this path. Turns that left the recent window are folded into the
+    # summary by the next rewrite, the scratchpad keeps the window meanwhile.
+    metrics.increment(f"reformulation.skipped.{reason}")
+    return {"question": state.question, "speculation": None}
 
-        for i in range(len(doc)):
-            text = doc[i].get_text()
-            all_pages.append(
-                Document(page_content=text, metadata={"page": i + 1, "file_name": pdf})
-            )
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=150,
-    )
+async def reformulate_question(state: State):
+    if reason := reformulation_skip_reason(state):
+        return await skip_reformulation(state, reason)
+    return {**await rewrite_question(state), "speculation": None}
 
-    docs = splitter.split_documents(all_pages)
 
-    faiss_index = FAISS.from_documents(docs, EMBED_MODEL)
+async def speculative_reformulate_question(state: State):
+    """
+    `reformulate_question` that retrieves documents for the raw question meanwhile.
+    The retrieve tool reuses them when the agent asks something close enough.
+    """
+    if reason := reformulation_skip_reason(state):
+        return await skip_reformulation(state, reason)
 
-    vs_path = get_vs_path(knowledge_name=knowledge_name, user_id=user_id)
-    faiss_index.save_local(vs_path)
+    async def timed(awaitable):
+        started = time.perf_counter()
+        result = await awaitable
+        return result, time.perf_counter() - started
 
-    logger.info("FAISS index built and saved.")
+    async def speculate():
+        try:
+            return await timed(
+                retrieve_documents(
+                    state.user_id, state.knowledge_names, state.question
+                )
+            )
+        except Exception as e:
+            # A failed speculation only costs the retrieval the tool does anyway.
+            logger.warning(f"Speculative retrieval failed: {e}")
+            return None
 
-    return {"success": True, "message": "All files indexed."}
+    (update, rewrite_seconds), speculated = await asyncio.gather(
+        timed(rewrite_question(state)), speculate()
+    )
+    speculation = None
+    if speculated is not None:
+        docs, retrieval_seconds = speculated
+        metrics.observe("speculation.retrieval", retrieval_seconds)
+        speculation = Speculation(
+            question=state.question,
+            docs=docs,
+            hidden_seconds=min(retrieval_seconds, rewrite_seconds),
+        )
+    return {**update, "speculation": speculation}
+
+
+async def rewrite_question(state: State) -> dict[str, Any]:
+    conversation = await get_sratchpad_from_messages(
+        state.messages, state.history_summary, state.summarized_turns
+    )
+    # Older turns are folded into the rolling summary while the question is rewritten.
+    reformulated_question, summary_update = await asyncio.gather(
+        get_llm("reformulate_question").ainvoke(
+            REFOMRULATE_PROMPT.format(
+                question=state.question, conversation=conversation
+            )
+        ),
+        update_history_summary(
+            state.messages, state.history_summary, state.summarized_turns
+        ),
+    )
+    return {"question": str(reformulated_question.content), **summary_update}
 
 
-async def reformulate_question(state: State):
-    if not state.messages:
-        return {"question": state.question}
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
-    )
+async def get_sratchpad_from_messages(
+    messages: list[AnyMessage], summary: str = "", summarized_turns: int = 0
+) -> str:
+    await load_tokenizer()
+    return build_scratchpad(messages, summary, summarized_turns)
 
-    if model is None:
-        raise ValueError("Failed to initialize language model.")
-    reformulated_question = await model.ainvoke(
-        REFOMRULATE_PROMPT.format(question=state.question, conversation=state.messages)
-    )
-    return {"question": str(reformulated_question.content)}
+
+# Nodes whose LLM output is the answer to the user, streamed token by token.
+ANSWER_NODES = {Steps.AGENT_NODE, FastSteps.ANSWER}
 
 
-async def get_sratchpad_from_messages(messages: list[AnyMessage]) -> str:
-    scratchpad = ""
-    for msg in messages:
-        if isinstance(msg, HumanMessage):
-            scratchpad += f"\nUser(Human) Asked : {msg.content}\n"
-        elif isinstance(msg, ToolMessage):
-            scratchpad += f"\nTool Result of {msg.name} tool: {msg.content}"
-        elif isinstance(msg, AIMessage):
-            if hasattr(msg, "tool_calls") and msg.tool_calls:
-                scratchpad += f"\nTool Called : {msg.tool_calls[0]['name']}\n"
-            else:
-                scratchpad += f"\nAssistant(AI) Message : {msg.content}\n"
-    return scratchpad
+def resolve_graph_mode(mode: GraphMode | None) -> GraphMode:
+    return GraphMode(mode or settings.retrieval_settings.DEFAULT_GRAPH_MODE)
 
 
-async def ask(knowledge_name: str, user_id: str, query: str) -> str:
+def build_rag_graph(mode: GraphMode | None = None) -> CompiledStateGraph:
+    if resolve_graph_mode(mode) == GraphMode.FAST:
+        return build_fast_graph()
+    return build_graph()
 
+
+async def get_rag_graph(mode: GraphMode | None = None) -> CompiledStateGraph:
     memory = await Memory.initialize_memory()
-    rag_graph: CompiledStateGraph = build_graph()
+    rag_graph: CompiledStateGraph = build_rag_graph(mode)
     if rag_graph.checkpointer is None:
         rag_graph.checkpointer = memory
+    return rag_graph
+
 
-    config = RunnableConfig(
+def get_ask_config(knowledge_names: list[str], user_id: str) -> RunnableConfig:
+    return RunnableConfig(
         configurable={
-            "thread_id": f"{user_id}_{knowledge_name}",
+            "thread_id": f"{user_id}_{','.join(knowledge_names)}",
         }
     )
-    response = await rag_graph.ainvoke(
-        {
-            "knowledge_name": knowledge_name,
-            "question": query,
-            "docs": [],
-            "user_id": user_id,
-            "answer": None,
-        },
+
+
+def get_ask_input(
+    knowledge_names: list[str], user_id: str, query: str
+) -> dict[str, Any]:
+    return {
+        "knowledge_names": knowledge_names,
+        "question": query,
+        "docs": [],
+        "user_id": user_id,
+        "answer": None,
+    }
+
+
+def observe_state_size(rag_graph: CompiledStateGraph, state: dict[str, Any]) -> None:
+    # Size of the state the checkpointer persists for this conversation.
+    _, state_bytes = rag_graph.checkpointer.serde.dumps_typed(state)  # type:ignore
+    metrics.observe("ask.state_bytes", len(state_bytes))
+
+
+async def ask(
+    knowledge_names: list[str],
+    user_id: str,
+    query: str,
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> str:
+    with metrics.timer("ask.total"), metrics.timer(
+        f"ask.total.{resolve_graph_mode(mode)}"
+    ):
+        rag_graph = rag_graph or await get_rag_graph(mode)
+        response = await rag_graph.ainvoke(
+            get_ask_input(knowledge_names, user_id, query),
+            config=get_ask_config(knowledge_names, user_id),
+        )
+    observe_state_size(rag_graph, response)
+
+    return response["answer"]
+
+
+async def ask_stream(
+    knowledge_names: list[str],
+    user_id: str,
+    query: str,
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Runs the same graph as `ask`, yielding a `node` event whenever a node finishes,
+    `token` events while the agent generates the final answer and a closing `answer`
+    event with the full answer and its timings.
+    """
+    started = time.perf_counter()
+    first_token_seconds: float | None = None
+    rag_graph = rag_graph or await get_rag_graph(mode)
+    config = get_ask_config(knowledge_names, user_id)
+
+    async for stream_mode, chunk in rag_graph.astream(
+        get_ask_input(knowledge_names, user_id, query),
         config=config,
+        stream_mode=["updates", "messages"],
+    ):
+        if stream_mode == "updates":
+            for node in chunk:
+                yield {
+                    "event": "node",
+                    "node": str(node),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000),
+                }
+            continue
+        message, metadata = chunk
+        # Only the answer nodes answer the user, and the agent only produces text
+        # content for the final answer. Tool calls and nested agents are not streamed.
+        if (
+            metadata.get("langgraph_node") not in ANSWER_NODES
+            or not isinstance(message, AIMessageChunk)
+            or not isinstance(message.content, str)
+            or not message.content
+        ):
+            continue
+        if first_token_seconds is None:
+            first_token_seconds = time.perf_counter() - started
+            metrics.observe("ask.stream.first_token", first_token_seconds)
+        yield {"event": "token", "text": message.content}
+
+    state = await rag_graph.aget_state(config)
+    observe_state_size(rag_graph, state.values)
+    total_seconds = time.perf_counter() - started
+    metrics.observe("ask.stream.total", total_seconds)
+    yield {
+        "event": "answer",
+        "answer": state.values["answer"],
+        "first_token_ms": (
+            round(first_token_seconds * 1000)
+            if first_token_seconds is not None
+            else None
+        ),
+        "total_ms": round(total_seconds * 1000),
+    }
+
+
+async def ask_batch(
+    knowledge_names: list[str],
+    user_id: str,
+    queries: list[str],
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Answers independent questions concurrently, at most `BATCH_ASK_CONCURRENCY` at a
+    time, and yields each result as soon as it is ready. Every question is the first
+    turn of its own conversation and nothing is checkpointed, so the user's thread is
+    left untouched. The vector stores are loaded before the first graph runs, in fast
+    mode all questions are also embedded in one batch.
+    """
+    started = time.perf_counter()
+    rag_graph = (
+        rag_graph.copy(update={"checkpointer": None})
+        if rag_graph is not None
+        else build_rag_graph(mode)
+    )
+    # The fast path embeds the question itself. The agent retrieves with a question
+    # of its own wording, which a batch embedding of the raw question would not hit.
+    embed_queries = resolve_graph_mode(mode) == GraphMode.FAST
+    await asyncio.gather(
+        *([QUERY_EMBEDDER.embed_many(queries)] if embed_queries else []),
+        *(
+            VECTORSTORE_CACHE.aget(
+                (user_id, knowledge_name),
+                get_vs_path(knowledge_name=knowledge_name, user_id=user_id),
+                EMBED_MODEL,
+            )
+            for knowledge_name in dict.fromkeys(knowledge_names)
+        ),
     )
+    metrics.observe("ask.batch.prepare", time.perf_counter() - started)
+    semaphore = asyncio.Semaphore(settings.retrieval_settings.BATCH_ASK_CONCURRENCY)
+
+    async def answer(index: int, query: str) -> dict[str, Any]:
+        queued = time.perf_counter()
+        async with semaphore:
+            item_started = time.perf_counter()
+            answer, error = None, None
+            try:
+                response = await rag_graph.ainvoke(
+                    get_ask_input(knowledge_names, user_id, query)
+                )
+                answer = response["answer"]
+            except Exception as e:
+                logger.error(f"Batch ask {index} failed for {knowledge_names}: {e}")
+                error = str(e)
+        finished = time.perf_counter()
+        metrics.observe("ask.batch.item", finished - item_started)
+        return {
+            "index": index,
+            "question": query,
+            "answer": answer,
+            "error": error,
+            "queue_ms": round((item_started - queued) * 1000),
+            "total_ms": round((finished - item_started) * 1000),
+        }
 
-    return response["answer"]
+    tasks = [
+        asyncio.create_task(answer(index, query)) for index, query in enumerate(queries)
+    ]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # The client may stop reading early, do not leave the questions running.
+        for task in tasks:
+            task.cancel()
+    metrics.observe("ask.batch.total", time.perf_counter() - started)
+    metrics.observe("ask.batch.size", len(queries))
@@ -0,0 +1,85 @@
+"""
+Compares recall@5 and query latency of the ANN index types against the flat baseline
+on a synthetic clustered corpus.
+
+Run from the repository root:
+    python -m benchmarks.ann_recall --chunks 100000 --dimension 1024
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ann import IndexType, build_index, default_index_params, set_search_params
+
+TOP_K = 5
+
+
+def synthetic_corpus(
+    chunks: int, queries: int, dimension: int, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    # Chunks of the same document embed close together, so the corpus is clustered.
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, chunks // 50), dimension)).astype("float32")
+    assignment = rng.integers(0, len(centers), chunks)
+    corpus = centers[assignment] + 0.3 * rng.standard_normal(
+        (chunks, dimension)
+    ).astype("float32")
+    picked = rng.integers(0, chunks, queries)
+    questions = corpus[picked] + 0.3 * rng.standard_normal((queries, dimension)).astype(
+        "float32"
+    )
+    return corpus, questions
+
+
+def measure(index, questions: np.ndarray) -> tuple[np.ndarray, float]:
+    found = np.empty((len(questions), TOP_K), dtype="int64")
+    started = time.perf_counter()
+    # One question at a time, like /ask does.
+    for row, question in enumerate(questions):
+        found[row] = index.search(question[None, :], TOP_K)[1][0]
+    return found, (time.perf_counter() - started) / len(questions) * 1000
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    args = parser.parse_args()
+
+    corpus, questions = synthetic_corpus(args.chunks, args.queries, args.dimension)
+
+    flat = build_index(IndexType.FLAT, corpus, {})
+    truth, flat_latency = measure(flat, questions)
+    print(f"{'index':<28} {'recall@5':>9} {'ms/query':>9} {'build s':>8}")
+    print(f"{'flat':<28} {1.0:>9.3f} {flat_latency:>9.3f} {'-':>8}")
+
+    for index_type, knob, values in (
+        (IndexType.HNSW, "efSearch", args.ef_search),
+        (IndexType.IVF, "nprobe", args.nprobe),
+    ):
+        params = default_index_params(index_type, args.chunks)
+        started = time.perf_counter()
+        index = build_index(index_type, corpus, params)
+        build_seconds = time.perf_counter() - started
+        for value in values:
+            set_search_params(index, {knob: value})
+            found, latency = measure(index, questions)
+            name = f"{index_type} {knob}={value}"
+            print(
+                f"{name:<28} {recall(found, truth):>9.3f} {latency:>9.3f} "
+                f"{build_seconds:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compares the time to first answer token of `POST /rag/ask/stream` with the end-to-end
+latency of `POST /rag/ask`, measured from the client against a running server.
+
+Run from the repository root while the API is up:
+    python -m benchmarks.ask_latency --knowledge-name manuals --question "What is E-1023?"
+"""
+
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+import requests  # type:ignore
+
+
+def time_ask(base_url: str, params: dict) -> float:
+    started = time.perf_counter()
+    res = requests.post(f"{base_url}/rag/ask", params=params)
+    res.raise_for_status()
+    return time.perf_counter() - started
+
+
+def time_ask_stream(base_url: str, params: dict) -> tuple[float | None, float]:
+    started = time.perf_counter()
+    first_token = None
+    with requests.post(f"{base_url}/rag/ask/stream", params=params, stream=True) as res:
+        res.raise_for_status()
+        for line in res.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: ") :])
+            if event["event"] == "token" and first_token is None:
+                first_token = time.perf_counter() - started
+            elif event["event"] == "error":
+                raise RuntimeError(event["detail"])
+    return first_token, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--knowledge-name", action="append", required=True)
+    parser.add_argument("--question", required=True)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    blocking, first_tokens, streamed = [], [], []
+    for _ in range(args.runs):
+        # A fresh user per run keeps earlier answers out of the conversation history.
+        params = {
+            "knowledge_name": args.knowledge_name,
+            "user_id": f"benchmark-{uuid.uuid4().hex[:8]}",
+            "query": args.question,
+        }
+        blocking.append(time_ask(args.base_url, params))
+        params["user_id"] = f"benchmark-{uuid.uuid4().hex[:8]}"
+        first_token, total = time_ask_stream(args.base_url, params)
+        if first_token is not None:
+            first_tokens.append(first_token)
+        streamed.append(total)
+
+    print(f"{args.runs} runs, median seconds")
+    print(f"{'/ask end-to-end':<28} {statistics.median(blocking):>8.3f}")
+    if first_tokens:
+        print(
+            f"{'/ask/stream first token':<28} {statistics.median(first_tokens):>8.3f}"
+        )
+    print(f"{'/ask/stream end-to-end':<28} {statistics.median(streamed):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
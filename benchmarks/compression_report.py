@@ -0,0 +1,107 @@
+"""
+Reports the index size and recall@5 of every vector compression option against the
+uncompressed float32 index, with and without re-ranking against exact vectors.
+
+Run from the repository root, either on an indexed knowledge base:
+    python -m benchmarks.compression_report --vs-path knowledges/<user>/<kb>/vectorstore
+or on a synthetic clustered corpus:
+    python -m benchmarks.compression_report --chunks 100000 --dimension 1024
+"""
+
+import argparse
+import os
+
+import faiss  # type:ignore
+import numpy as np
+
+from ann import (
+    Compression,
+    IndexType,
+    build_index,
+    choose_compression,
+    default_index_params,
+    reconstruct_all,
+)
+from benchmarks.ann_recall import TOP_K, measure, recall, synthetic_corpus
+from exact_vectors import ExactVectorStore
+from vectorstores import INDEX_FILE_NAME
+
+
+def knowledge_corpus(
+    vs_path: str, queries: int, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    exact = ExactVectorStore.open(vs_path)
+    if exact is not None:
+        corpus = exact.vectors()
+    else:
+        corpus = reconstruct_all(
+            faiss.read_index(os.path.join(vs_path, INDEX_FILE_NAME))
+        )
+    # Questions land near the chunks that answer them, so sampled chunks plus noise
+    # stand in for real questions.
+    rng = np.random.default_rng(seed)
+    picked = rng.integers(0, len(corpus), queries)
+    noise = 0.1 * corpus.std() * rng.standard_normal((queries, corpus.shape[1]))
+    return corpus, (corpus[picked] + noise).astype("float32")
+
+
+def rerank_all(
+    index, corpus: np.ndarray, questions: np.ndarray, factor: int
+) -> np.ndarray:
+    candidates = index.search(questions, TOP_K * factor)[1]
+    found = np.full((len(questions), TOP_K), -1, dtype="int64")
+    for row, (question, ids) in enumerate(zip(questions, candidates)):
+        ids = ids[ids != -1]
+        distances = ((corpus[ids] - question) ** 2).sum(axis=1)
+        best = ids[np.argsort(distances)[:TOP_K]]
+        found[row, : len(best)] = best
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vs-path")
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--index-type", type=IndexType, default=IndexType.FLAT)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.vs_path:
+        corpus, questions = knowledge_corpus(args.vs_path, args.queries)
+    else:
+        corpus, questions = synthetic_corpus(args.chunks, args.queries, args.dimension)
+
+    index_type = args.index_type
+    if index_type == IndexType.AUTO:
+        raise SystemExit("Pick a concrete --index-type to compare compression on.")
+    params = default_index_params(index_type, len(corpus))
+    baseline = build_index(IndexType.FLAT, corpus, {})
+    truth, _ = measure(baseline, questions)
+
+    print(f"{len(corpus)} vectors of dimension {corpus.shape[1]}, {index_type} index")
+    print(
+        f"{'compression':<12} {'size MB':>9} {'ratio':>6} {'recall@5':>9} "
+        f"{'+rerank':>8} {'ms/query':>9}"
+    )
+    baseline_size = None
+    for compression in Compression:
+        resolved = choose_compression(compression, len(corpus))
+        if resolved != compression:
+            print(f"{compression:<12} too few vectors to train, would use {resolved}")
+            continue
+        index = build_index(index_type, corpus, params, compression)
+        size = len(faiss.serialize_index(index))
+        baseline_size = baseline_size or size
+        found, latency = measure(index, questions)
+        reranked = rerank_all(index, corpus, questions, args.rerank_factor)
+        print(
+            f"{compression:<12} {size / 1024**2:>9.1f} {baseline_size / size:>5.1f}x "
+            f"{recall(found, truth):>9.3f} {recall(reranked, truth):>8.3f} "
+            f"{latency:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Reports embedding throughput (chunks per second) for several engine configurations.
+
+Run from the repository root:
+    python -m benchmarks.embedding_throughput --chunks 2000 --threads 4 8
+"""
+
+import argparse
+import random
+import time
+
+from embeddings import EmbeddingEngine
+from settings import settings
+
+WORDS = (
+    "pump valve pressure sensor calibration error code manual maintenance procedure "
+    "warning torque bolt assembly firmware update network interface configuration"
+).split()
+
+
+def synthetic_chunks(count: int, seed: int = 0) -> list[str]:
+    # Lengths are spread like real splitter output: mostly full chunks, some short tails.
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        words = rng.choice([rng.randint(5, 40), rng.randint(80, 140)])
+        chunks.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+    return chunks
+
+
+def run(engine: EmbeddingEngine, chunks: list[str]) -> float:
+    engine.warmup()
+    started = time.perf_counter()
+    engine.embed_documents(chunks)
+    return len(chunks) / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--device", default=settings.embedding_settings.DEVICE)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--budgets-mb", type=int, nargs="+", default=[256, 1024])
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    model_name = settings.embedding_settings.MODEL_NAME
+
+    configs: list[tuple[str, dict]] = []
+    for threads in args.threads:
+        # The previous fixed setup: four inputs per forward pass.
+        configs.append(
+            (
+                f"fixed batch=4 threads={threads}",
+                {
+                    "num_threads": threads,
+                    "max_batch_size": 4,
+                    "memory_budget_mb": 10**6,
+                },
+            )
+        )
+        for budget in args.budgets_mb:
+            configs.append(
+                (
+                    f"bucketed budget={budget}MB threads={threads}",
+                    {"num_threads": threads, "memory_budget_mb": budget},
+                )
+            )
+
+    print(f"{'configuration':<45} {'chunks/s':>10}")
+    for name, kwargs in configs:
+        engine = EmbeddingEngine(model_name=model_name, device=args.device, **kwargs)
+        print(f"{name:<45} {run(engine, chunks):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
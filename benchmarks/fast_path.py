@@ -0,0 +1,84 @@
+"""
+Compares the LLM calls and latency per question of the fast-path graph with the agentic
+graph. Every question runs as the first turn of a fresh conversation in both modes.
+LLM calls answered from the response cache are not counted.
+
+Run from the repository root on an indexed knowledge base while the model server is up:
+    python -m benchmarks.fast_path --user-id <user> --knowledge-name manuals \\
+        --question "What is E-1023?" --question "Summarize the manuals"
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from langchain_core.runnables.config import RunnableConfig
+
+from backend import get_ask_input, get_rag_graph
+from fast_graph import GraphMode
+from llm import close_llm_pool
+from metrics import metrics
+
+
+def count_llm_calls() -> int:
+    timings = metrics.snapshot()["timings"]
+    return sum(
+        int(summary["count"])
+        for name, summary in timings.items()
+        if name.startswith("llm.latency.")
+    )
+
+
+async def time_question(
+    mode: GraphMode, knowledge_names: list[str], user_id: str, question: str
+) -> tuple[float, int]:
+    rag_graph = await get_rag_graph(mode)
+    config = RunnableConfig(
+        configurable={"thread_id": f"benchmark-{mode}-{uuid.uuid4().hex[:8]}"}
+    )
+    calls = count_llm_calls()
+    started = time.perf_counter()
+    await rag_graph.ainvoke(
+        get_ask_input(knowledge_names, user_id, question), config=config
+    )
+    return time.perf_counter() - started, count_llm_calls() - calls
+
+
+async def run(args: argparse.Namespace) -> None:
+    results: dict[GraphMode, tuple[list[float], list[int]]] = {
+        mode: ([], []) for mode in GraphMode
+    }
+    try:
+        for _ in range(args.runs):
+            for question in args.question:
+                for mode in GraphMode:
+                    seconds, calls = await time_question(
+                        mode, args.knowledge_name, args.user_id, question
+                    )
+                    results[mode][0].append(seconds)
+                    results[mode][1].append(calls)
+    finally:
+        await close_llm_pool()
+
+    print(f"{len(args.question)} questions x {args.runs} runs, per question")
+    print(f"{'graph':<10} {'LLM calls':>10} {'p50 s':>8} {'mean s':>8}")
+    for mode, (seconds, calls) in results.items():
+        print(
+            f"{mode:<10} {statistics.mean(calls):>10.2f} "
+            f"{statistics.median(seconds):>8.3f} {statistics.mean(seconds):>8.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--knowledge-name", action="append", required=True)
+    parser.add_argument("--question", action="append", required=True)
+    parser.add_argument("--runs", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares reading page text back from the text store with parsing the PDFs again.
+
+Run from the repository root on an indexed knowledge base:
+    python -m benchmarks.text_store_read --knowledge-path knowledges/<user>/<kb>
+"""
+
+import argparse
+import os
+import time
+
+from extraction import iter_page_ranges, shutdown_extraction_executor
+from text_store import TEXT_STORE_FILE_NAME, TextStore
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge-path", required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    store = TextStore(os.path.join(args.knowledge_path, TEXT_STORE_FILE_NAME))
+    docs_path = os.path.join(args.knowledge_path, "docs")
+    file_names = [f for f in store.file_names() if store.hash_of(f) is not None]
+    if not file_names:
+        raise SystemExit("The text store is empty, index the knowledge base first.")
+    files = [(f, os.path.join(docs_path, f)) for f in file_names]
+
+    try:
+        # The first run starts the worker processes, keep it out of the timing.
+        for _ in iter_page_ranges(files):
+            pass
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            pages = sum(len(page_range.pages) for page_range in iter_page_ranges(files))
+        parse_seconds = (time.perf_counter() - started) / args.repeat
+    finally:
+        shutdown_extraction_executor()
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        stored = sum(1 for f in file_names for _ in store.iter_pages(f))
+    read_seconds = (time.perf_counter() - started) / args.repeat
+
+    store_size = os.path.getsize(store.path)
+    print(f"{len(file_names)} files, {pages} pages ({stored} stored)")
+    print(f"{'source':<12} {'seconds':>9} {'pages/s':>10}")
+    print(f"{'parse PDFs':<12} {parse_seconds:>9.3f} {pages / parse_seconds:>10.0f}")
+    print(f"{'text store':<12} {read_seconds:>9.3f} {stored / read_seconds:>10.0f}")
+    print(f"text store size {store_size / 1024**2:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
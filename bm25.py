@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import Counter
+
+from metrics import metrics
+from settings import settings
+
+BM25_FILE_NAME = "bm25.sqlite"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-cased word tokens. Compound tokens such as part numbers (`E-1023`, `v2.3.1`)
+    are kept whole and their parts are emitted as well, so both forms match.
+    """
+    tokens: list[str] = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    Compact on-disk inverted index over the chunks of one knowledge base, stored next to
+    the FAISS files in `bm25.sqlite` and keyed by the same docstore IDs.
+    """
+
+    def __init__(self, path: str, read_only: bool = False) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # Read-only files are never modified in place, their statistics are read once.
+        self.fixed_stats: tuple[int, int] | None = None
+        if read_only:
+            self.conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+            self.fixed_stats = self._read_stats()
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, length INTEGER);"
+            "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER);"
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_id TEXT, tf INTEGER, "
+            "PRIMARY KEY (term, doc_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_doc_id ON postings(doc_id);"
+            "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "doc_count INTEGER, total_length INTEGER);"
+            # Files written before the stats row existed are counted once.
+            "INSERT OR IGNORE INTO stats (id, doc_count, total_length) "
+            "SELECT 0, COUNT(*), COALESCE(SUM(length), 0) FROM docs;"
+        )
+        self.conn.commit()
+
+    def _read_stats(self) -> tuple[int, int]:
+        """Number of documents and their total length in tokens."""
+        try:
+            row = self.conn.execute(
+                "SELECT doc_count, total_length FROM stats WHERE id = 0"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # Read-only file written before the stats row existed.
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs"
+            ).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    @classmethod
+    def open_for_update(cls, vs_path: str, exists: bool) -> "BM25Index":
+        """Opens a private working copy that `save` swaps in next to the FAISS files."""
+        os.makedirs(vs_path, exist_ok=True)
+        path = os.path.join(vs_path, BM25_FILE_NAME)
+        working_path = f"{path}.tmp"
+        if os.path.exists(working_path):
+            os.remove(working_path)
+        if exists and os.path.exists(path):
+            shutil.copyfile(path, working_path)
+        return cls(working_path)
+
+    @classmethod
+    def open(cls, vs_path: str) -> "BM25Index | None":
+        path = os.path.join(vs_path, BM25_FILE_NAME)
+        return cls(path, read_only=True) if os.path.exists(path) else None
+
+    def add(self, doc_ids: list[str], texts: list[str]) -> None:
+        with self.lock:
+            total_length = 0
+            for doc_id, text in zip(doc_ids, texts):
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                total_length += length
+                self.conn.execute(
+                    "INSERT INTO docs (doc_id, length) VALUES (?, ?)", (doc_id, length)
+                )
+                self.conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+                self.conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) "
+                    "ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts],
+                )
+            self.conn.execute(
+                "UPDATE stats SET doc_count = doc_count + ?, "
+                "total_length = total_length + ? WHERE id = 0",
+                (len(doc_ids), total_length),
+            )
+            self.conn.commit()
+
+    def remove(self, doc_ids: list[str]) -> None:
+        with self.lock:
+            removed, removed_length = 0, 0
+            for doc_id in doc_ids:
+                row = self.conn.execute(
+                    "SELECT length FROM docs WHERE doc_id = ?", (doc_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                removed += 1
+                removed_length += row[0]
+                terms = self.conn.execute(
+                    "SELECT term FROM postings WHERE doc_id = ?", (doc_id,)
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE terms SET df = df - 1 WHERE term = ?", terms
+                )
+                self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                self.conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM terms WHERE df <= 0")
+            self.conn.execute(
+                "UPDATE stats SET doc_count = doc_count - ?, "
+                "total_length = total_length - ? WHERE id = 0",
+                (removed, removed_length),
+            )
+            self.conn.commit()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM docs LIMIT 1").fetchone() is None
+
+    def save(self, vs_path: str) -> None:
+        with self.lock:
+            self.conn.execute("VACUUM")
+            self.conn.close()
+        os.replace(self.path, os.path.join(vs_path, BM25_FILE_NAME))
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """
+        Scores documents in SQLite. Terms found in more than `BM25_MAX_DF_RATIO` of the
+        documents add almost nothing to the ranking but have the longest posting lists,
+        so they are skipped unless the query has no rarer term.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        retrieval_settings = settings.retrieval_settings
+        k1 = retrieval_settings.BM25_K1
+        b = retrieval_settings.BM25_B
+        with self.lock:
+            doc_count, total_length = self.fixed_stats or self._read_stats()
+            if not doc_count:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            frequencies = self.conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({placeholders}) ORDER BY df",
+                terms,
+            ).fetchall()
+            if not frequencies:
+                return []
+            max_df = retrieval_settings.BM25_MAX_DF_RATIO * doc_count
+            scored = [(term, df) for term, df in frequencies if df <= max_df]
+            scored = scored or frequencies[:1]
+            if len(scored) < len(frequencies):
+                metrics.increment(
+                    "retrieval.bm25_skipped_terms", len(frequencies) - len(scored)
+                )
+            weights = [
+                (term, math.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+                for term, df in scored
+            ]
+            values = ",".join("(?, ?)" for _ in weights)
+            average_length = total_length / doc_count
+            return self.conn.execute(
+                f"WITH query (term, idf) AS (VALUES {values}) "
+                "SELECT p.doc_id, SUM(q.idf * p.tf * (? + 1) / "
+                "(p.tf + ? * (1 - ? + ? * d.length / ?))) AS score "
+                "FROM query q JOIN postings p ON p.term = q.term "
+                "JOIN docs d ON d.doc_id = p.doc_id "
+                "GROUP BY p.doc_id ORDER BY score DESC LIMIT ?",
+                [
+                    *(value for weight in weights for value in weight),
+                    k1,
+                    k1,
+                    b,
+                    b,
+                    average_length,
+                    k,
+                ],
+            ).fetchall()
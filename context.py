@@ -0,0 +1,77 @@
+import re
+
+from langchain_community.docstore.document import Document
+
+# Neighbouring chunks of a page overlap by the splitter's 150 characters, anything up to
+# this long is checked when stitching them.
+MAX_CHUNK_OVERLAP = 200
+MIN_CHUNK_OVERLAP = 20
+WHITESPACE = re.compile(r"\s+")
+
+
+def source_of(doc: Document) -> str:
+    parts = [str(doc.metadata.get("file_name", "unknown"))]
+    if "page" in doc.metadata:
+        parts.append(f"page {doc.metadata['page']}")
+    if "knowledge_name" in doc.metadata:
+        parts.append(str(doc.metadata["knowledge_name"]))
+    return ", ".join(parts)
+
+
+def trim_overlap(previous: str, text: str) -> str:
+    """Drops the start of `text` that repeats the end of `previous`."""
+    longest = min(len(previous), len(text), MAX_CHUNK_OVERLAP)
+    for size in range(longest, MIN_CHUNK_OVERLAP - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+def dedupe_docs(docs: list[Document]) -> list[tuple[str, str]]:
+    """
+    `(source, text)` pairs with whitespace collapsed, repeated chunks dropped and the
+    overlap between chunks of the same page trimmed.
+    """
+    seen: set[str] = set()
+    last_text_per_source: dict[str, str] = {}
+    compacted: list[tuple[str, str]] = []
+    for doc in docs:
+        text = WHITESPACE.sub(" ", doc.page_content).strip()
+        key = doc.id or text
+        if not text or key in seen or text in seen:
+            continue
+        seen.update((key, text))
+        source = source_of(doc)
+        if source in last_text_per_source:
+            text = trim_overlap(last_text_per_source[source], text)
+        last_text_per_source[source] = text
+        if text:
+            compacted.append((source, text))
+    return compacted
+
+
+def format_docs(docs: list[Document] | None) -> str:
+    """Numbered chunk texts with their source, as compact context for LLM prompts."""
+    if not docs:
+        return "No documents retrieved."
+    return "\n\n".join(
+        f"[{number}] {source}\n{text}"
+        for number, (source, text) in enumerate(dedupe_docs(docs), start=1)
+    )
+
+
+def describe_docs(docs: list[Document]) -> str:
+    """One-line summary of retrieved chunks for the conversation scratchpad."""
+    if not docs:
+        return "No relevant documents found."
+    pages: dict[str, list[str]] = {}
+    for doc in docs:
+        file_name = str(doc.metadata.get("file_name", "unknown"))
+        page = str(doc.metadata.get("page", "?"))
+        if page not in pages.setdefault(file_name, []):
+            pages[file_name].append(page)
+    sources = "; ".join(
+        f"{file_name} (pages {', '.join(file_pages)})"
+        for file_name, file_pages in pages.items()
+    )
+    return f"Retrieved {len(docs)} chunks from {sources}."
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import threading
+from collections.abc import Iterator, Mapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.document import Document
+
+
+def connect(path: str, read_only: bool) -> sqlite3.Connection:
+    if read_only:
+        # Read-only connections never write a journal, so any number of workers can
+        # share the database pages through the OS page cache.
+        return sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS docs "
+        "(id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS idmap (position INTEGER PRIMARY KEY, id TEXT NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore backed by an SQLite file instead of a pickled in-memory dict."""
+
+    def __init__(self, path: str, read_only: bool = False) -> None:
+        self.path = path
+        self.read_only = read_only
+        self.conn = connect(path, read_only=read_only)
+        self.lock = threading.Lock()
+
+    def search(self, search: str) -> str | Document:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content, metadata FROM docs WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        content, metadata = row
+        return Document(page_content=content, metadata=json.loads(metadata), id=search)
+
+    def add(self, texts: dict[str, Document]) -> None:
+        with self.lock:
+            placeholders = ",".join("?" * len(texts))
+            overlapping = self.conn.execute(
+                f"SELECT id FROM docs WHERE id IN ({placeholders})", list(texts)
+            ).fetchall()
+            if overlapping:
+                raise ValueError(
+                    f"Tried to add ids that already exist: {[r[0] for r in overlapping]}"
+                )
+            self.conn.executemany(
+                "INSERT INTO docs (id, content, metadata) VALUES (?, ?, ?)",
+                [
+                    (doc_id, doc.page_content, json.dumps(doc.metadata))
+                    for doc_id, doc in texts.items()
+                ],
+            )
+            self.conn.commit()
+
+    def delete(self, ids: list) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids]
+            )
+            self.conn.commit()
+
+    def write_index_mapping(self, index_to_docstore_id: Mapping[int, str]) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM idmap")
+            self.conn.executemany(
+                "INSERT INTO idmap (position, id) VALUES (?, ?)",
+                [
+                    (int(position), doc_id)
+                    for position, doc_id in index_to_docstore_id.items()
+                ],
+            )
+            self.conn.commit()
+
+    def read_index_mapping(self) -> dict[int, str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT position, id FROM idmap").fetchall()
+        return {position: doc_id for position, doc_id in rows}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class SQLiteIndexMapping(Mapping[int, str]):
+    """Lazy, read-only `index_to_docstore_id` mapping served from the docstore file."""
+
+    def __init__(self, docstore: SQLiteDocstore) -> None:
+        self.docstore = docstore
+        with docstore.lock:
+            row = docstore.conn.execute("SELECT COUNT(*) FROM idmap").fetchone()
+        self.size: int = row[0]
+
+    def __getitem__(self, position: int) -> str:
+        with self.docstore.lock:
+            # FAISS hands over numpy integers, which sqlite3 cannot bind.
+            row = self.docstore.conn.execute(
+                "SELECT id FROM idmap WHERE position = ?", (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        with self.docstore.lock:
+            rows = self.docstore.conn.execute(
+                "SELECT position FROM idmap ORDER BY position"
+            ).fetchall()
+        return iter(row[0] for row in rows)
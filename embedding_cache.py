@@ -0,0 +1,162 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logger import logger
+from metrics import metrics
+
+# After an eviction the cache is trimmed to this fraction of its budget so that
+# evictions do not run on every single insert once the cache is full.
+EVICTION_TARGET_RATIO = 0.9
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache keyed by model name plus chunk-text hash. Each vector is a
+    raw float32 BLOB in a SQLite table whose primary key serves as the index, so
+    concurrent index jobs and LRU eviction need no separate array file to compact.
+    The least recently used entries are evicted once the stored vectors exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings(last_access)"
+        )
+        self.conn.commit()
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings")
+        self.total_bytes: int = row.fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        now = time.time()
+        with self.lock:
+            # SQLite limits the number of bound parameters, query in slices.
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self.lock:
+            for row in rows:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, size, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount == 1:
+                    self.total_bytes += row[2]
+            self.conn.commit()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        to_free = self.total_bytes - target
+        evicted = 0
+        freed = 0
+        cursor = self.conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        )
+        keys: list[str] = []
+        for key, size in cursor:
+            if freed >= to_free:
+                break
+            keys.append(key)
+            freed += size
+            evicted += 1
+        self.conn.executemany(
+            "DELETE FROM embeddings WHERE key = ?", [(k,) for k in keys]
+        )
+        self.conn.commit()
+        self.total_bytes -= freed
+        metrics.increment("embedding_cache.evictions", evicted)
+        logger.info(f"Embedding cache evicted {evicted} entries ({freed} bytes)")
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": entries,
+            "size_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hit_rate": metrics.ratio("embedding_cache.hits", "embedding_cache.misses"),
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model so only cache misses reach the model."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        metrics.increment("embedding_cache.hits", len(texts) - len(missing))
+        metrics.increment("embedding_cache.misses", len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.embeddings import Embeddings
+
+from logger import logger
+from metrics import metrics
+
+# Rough activation memory per token and hidden unit during a forward pass, used to turn
+# the configured memory budget into a token budget per batch.
+BYTES_PER_TOKEN_PER_HIDDEN_UNIT = 64
+
+
+def resolve_device(device: str) -> str:
+    if device != "auto":
+        return device
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    return "out of memory" in str(error).lower()
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    Sentence-transformers wrapper for the embedding model. Inputs are sorted by token
+    length and packed into batches that fit a token budget derived from
+    `memory_budget_mb`, so short chunks are embedded in large batches and long chunks
+    in small ones with little padding. The budget is halved whenever a batch runs out
+    of memory. The model is loaded lazily on first use or by `warmup`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "auto",
+        num_threads: int = 0,
+        max_batch_size: int = 64,
+        memory_budget_mb: int = 1024,
+    ) -> None:
+        self.model_name = model_name
+        self.device = device
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size
+        self.memory_budget_mb = memory_budget_mb
+        self.token_budget: int | None = None
+        self._model: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> Any:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _load_model(self) -> Any:
+        import torch
+        from sentence_transformers import SentenceTransformer  # type:ignore
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        device = resolve_device(self.device)
+        model = SentenceTransformer(
+            self.model_name, device=device, trust_remote_code=True
+        )
+        hidden_size = model.get_sentence_embedding_dimension() or 1024
+        self.token_budget = max(
+            model.max_seq_length,
+            self.memory_budget_mb
+            * 1024**2
+            // (hidden_size * BYTES_PER_TOKEN_PER_HIDDEN_UNIT),
+        )
+        logger.info(
+            f"Embedding model {self.model_name} loaded on {device} "
+            f"(threads={torch.get_num_threads()}, token budget={self.token_budget})"
+        )
+        return model
+
+    def warmup(self) -> None:
+        self.embed_documents(["warmup"])
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        encoded = self.model.tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def _buckets(self, lengths: list[int]) -> list[list[int]]:
+        """Groups input positions, shortest first, into batches within the token budget."""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        budget = self.token_budget or self.model.max_seq_length
+        buckets: list[list[int]] = []
+        current: list[int] = []
+        for position in order:
+            # Batches are padded to their longest input, which is the latest one added.
+            padded = (len(current) + 1) * max(lengths[position], 1)
+            if current and (padded > budget or len(current) >= self.max_batch_size):
+                buckets.append(current)
+                current = []
+            current.append(position)
+        if current:
+            buckets.append(current)
+        return buckets
+
+    def _encode_batch(self, texts: list[str]) -> list[list[float]]:
+        try:
+            vectors = self.model.encode(
+                texts,
+                batch_size=len(texts),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            return vectors.tolist()
+        except RuntimeError as e:
+            if not is_out_of_memory(e) or len(texts) == 1:
+                raise
+            self.token_budget = max(1, (self.token_budget or 2) // 2)
+            metrics.increment("embedding.oom_retries")
+            logger.warning(
+                f"Embedding batch of {len(texts)} ran out of memory, "
+                f"token budget lowered to {self.token_budget}"
+            )
+            middle = len(texts) // 2
+            return self._encode_batch(texts[:middle]) + self._encode_batch(
+                texts[middle:]
+            )
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        vectors: list[list[float]] = [[] for _ in texts]
+        with metrics.timer("embedding.encode"):
+            for bucket in self._buckets(self._token_lengths(texts)):
+                encoded = self._encode_batch([texts[i] for i in bucket])
+                for position, vector in zip(bucket, encoded):
+                    vectors[position] = vector
+        metrics.increment("embedding.texts", len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class QueryEmbeddingBatcher:
+    """
+    Collects query embeddings requested by concurrent coroutines for up to `max_wait_ms`
+    or `max_batch_size` questions and embeds them in one forward pass. Each caller gets
+    its own vector back through a future. The last `cache_entries` questions are kept,
+    so a question embedded once, e.g. by `embed_many`, is not embedded again.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_wait_ms: float,
+        max_batch_size: int,
+        cache_entries: int = 0,
+    ) -> None:
+        self.embeddings = embeddings
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.cache_entries = cache_entries
+        self.recent: OrderedDict[str, list[float]] = OrderedDict()
+        self.pending: list[tuple[str, asyncio.Future]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def _cached(self, text: str) -> list[float] | None:
+        vector = self.recent.get(text)
+        if vector is None:
+            return None
+        self.recent.move_to_end(text)
+        metrics.increment("embedding.query_cache_hits")
+        return vector
+
+    def _remember(self, text: str, vector: list[float]) -> None:
+        if self.cache_entries <= 0:
+            return
+        self.recent[text] = vector
+        self.recent.move_to_end(text)
+        while len(self.recent) > self.cache_entries:
+            self.recent.popitem(last=False)
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        """Embeds the questions not seen recently in one call, e.g. for a batch of asks."""
+        vectors: dict[str, list[float]] = {}
+        missing: list[str] = []
+        for text in dict.fromkeys(texts):
+            cached = self._cached(text)
+            if cached is None:
+                missing.append(text)
+            else:
+                vectors[text] = cached
+        if missing:
+            metrics.observe("embedding.query_batch_size", len(missing))
+            embedded = await asyncio.to_thread(self.embeddings.embed_documents, missing)
+            for text, vector in zip(missing, embedded):
+                self._remember(text, vector)
+                vectors[text] = vector
+        return [vectors[text] for text in texts]
+
+    async def embed(self, text: str) -> list[float]:
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        metrics.observe("embedding.query_batch_size", len(batch))
+        try:
+            # The engine embeds queries and documents identically, so a batch of
+            # questions goes through `embed_documents` as one forward pass.
+            vectors = await asyncio.to_thread(
+                self.embeddings.embed_documents, [text for text, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (text, future), vector in zip(batch, vectors):
+            self._remember(text, vector)
+            if not future.done():
+                future.set_result(vector)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+
+EXACT_VECTORS_FILE_NAME = "vectors.sqlite"
+
+
+class ExactVectorStore:
+    """
+    Full-precision float32 embeddings of a knowledge base whose FAISS index is compressed,
+    stored in `vectors.sqlite` next to the FAISS files and keyed by docstore ID. Only the
+    candidates being re-ranked are read, so they stay on disk rather than in RAM.
+    """
+
+    def __init__(self, path: str, read_only: bool = False) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        if read_only:
+            self.conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (doc_id TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self.conn.commit()
+
+    @classmethod
+    def open_for_update(cls, vs_path: str, exists: bool) -> "ExactVectorStore":
+        """Opens a private working copy that `save` swaps in next to the FAISS files."""
+        os.makedirs(vs_path, exist_ok=True)
+        path = os.path.join(vs_path, EXACT_VECTORS_FILE_NAME)
+        working_path = f"{path}.tmp"
+        if os.path.exists(working_path):
+            os.remove(working_path)
+        if exists and os.path.exists(path):
+            shutil.copyfile(path, working_path)
+        return cls(working_path)
+
+    @classmethod
+    def open(cls, vs_path: str) -> "ExactVectorStore | None":
+        path = os.path.join(vs_path, EXACT_VECTORS_FILE_NAME)
+        return cls(path, read_only=True) if os.path.exists(path) else None
+
+    def add(self, doc_ids: list[str], vectors: np.ndarray | list[list[float]]) -> None:
+        rows = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vectors (doc_id, vector) VALUES (?, ?)",
+                [(doc_id, row.tobytes()) for doc_id, row in zip(doc_ids, rows)],
+            )
+            self.conn.commit()
+
+    def remove(self, doc_ids: list[str]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM vectors WHERE doc_id = ?",
+                [(doc_id,) for doc_id in doc_ids],
+            )
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def get_many(self, doc_ids: list[str]) -> dict[str, np.ndarray]:
+        found: dict[str, np.ndarray] = {}
+        with self.lock:
+            # SQLite limits the number of bound parameters, query in slices.
+            for start in range(0, len(doc_ids), 500):
+                batch = doc_ids[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT doc_id, vector FROM vectors WHERE doc_id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for doc_id, blob in rows:
+                    found[doc_id] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def vectors(self) -> np.ndarray:
+        with self.lock:
+            rows = self.conn.execute("SELECT vector FROM vectors").fetchall()
+        return np.stack([np.frombuffer(blob, dtype=np.float32) for (blob,) in rows])
+
+    def save(self, vs_path: str) -> None:
+        with self.lock:
+            self.conn.execute("VACUUM")
+            self.conn.close()
+        os.replace(self.path, os.path.join(vs_path, EXACT_VECTORS_FILE_NAME))
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def rerank(
+    candidates: list[tuple[str, float]],
+    exact: ExactVectorStore,
+    embedding: list[float],
+    k: int,
+) -> list[tuple[str, float]]:
+    """Re-scores candidates by their exact L2 distance to the question, closest first."""
+    vectors = exact.get_many([doc_id for doc_id, _ in candidates])
+    query = np.asarray(embedding, dtype=np.float32)
+    rescored = [
+        (
+            doc_id,
+            (
+                float(np.sum((vectors[doc_id] - query) ** 2))
+                if doc_id in vectors
+                else distance
+            ),
+        )
+        for doc_id, distance in candidates
+    ]
+    return sorted(rescored, key=lambda item: item[1])[:k]
@@ -0,0 +1,121 @@
+import multiprocessing
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import fitz  # type:ignore
+from langchain_community.docstore.document import Document
+
+from settings import settings
+
+_executor: ProcessPoolExecutor | None = None
+
+
+@dataclass
+class PageRange:
+    file_name: str
+    pages: list[Document] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+    last: bool = True
+    error: str | None = None
+
+
+def get_extraction_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # "spawn" keeps the workers free of the parent's CUDA context and model threads.
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.indexing_settings.EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_extraction_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def _count_pages(pdf_full_path: str) -> int:
+    with fitz.open(pdf_full_path) as doc:
+        return len(doc)
+
+
+def _extract_page_range(
+    pdf_full_path: str, start: int, end: int
+) -> tuple[list[str], float]:
+    # Runs inside a worker process, every worker opens its own fitz document.
+    started = time.perf_counter()
+    with fitz.open(pdf_full_path) as doc:
+        texts = [doc[i].get_text() for i in range(start, end)]
+    return texts, time.perf_counter() - started
+
+
+def _plan_file_tasks(pdf_full_path: str) -> list[tuple[int, int]]:
+    page_count = _count_pages(pdf_full_path)
+    step = max(1, settings.indexing_settings.PAGES_PER_TASK)
+    return [
+        (start, min(start + step, page_count)) for start in range(0, page_count, step)
+    ]
+
+
+def _completed_future(
+    result: tuple[list[str], float] | None = None, error: Exception | None = None
+) -> Future:
+    future: Future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def iter_page_ranges(files: list[tuple[str, str]]) -> Iterator[PageRange]:
+    """
+    Extracts the text of the given `(file_name, pdf_full_path)` pairs on the process pool.
+    Page ranges of every file are spread across the workers but yielded in submission
+    order, so files come out in input order and pages in page order. Only a bounded
+    window of tasks is in flight at a time, which keeps memory flat for large corpora.
+    """
+    executor = get_extraction_executor()
+    max_in_flight = max(2, settings.indexing_settings.EXTRACTION_WORKERS * 2)
+    in_flight: deque[tuple[str, int, bool, Future]] = deque()
+
+    def drain_one() -> PageRange:
+        file_name, start, last, future = in_flight.popleft()
+        try:
+            texts, elapsed = future.result()
+        except Exception as e:
+            return PageRange(file_name=file_name, last=last, error=str(e))
+        pages = [
+            Document(
+                page_content=text,
+                metadata={"page": start + offset + 1, "file_name": file_name},
+            )
+            for offset, text in enumerate(texts)
+        ]
+        return PageRange(
+            file_name=file_name, pages=pages, elapsed_seconds=elapsed, last=last
+        )
+
+    for file_name, pdf_full_path in files:
+        try:
+            tasks = _plan_file_tasks(pdf_full_path)
+        except Exception as e:
+            in_flight.append((file_name, 0, True, _completed_future(error=e)))
+            continue
+        if not tasks:
+            in_flight.append((file_name, 0, True, _completed_future(([], 0.0))))
+            continue
+        for position, (start, end) in enumerate(tasks):
+            while len(in_flight) >= max_in_flight:
+                yield drain_one()
+            future = executor.submit(_extract_page_range, pdf_full_path, start, end)
+            in_flight.append((file_name, start, position == len(tasks) - 1, future))
+
+    while in_flight:
+        yield drain_one()
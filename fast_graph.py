@@ -0,0 +1,214 @@
+import asyncio
+import re
+from enum import StrEnum
+
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, StateGraph
+from langgraph.graph.state import CompiledStateGraph
+
+from context import format_docs
+from llm import get_llm
+from logger import logger
+from main_graph import State, Steps
+from metrics import metrics, observe_llm_usage
+from prompts import FAST_RAG_PROMPT
+from retrieval import retrieve_documents
+from retrieval_cache import RetrievalCache
+from settings import settings
+from tools import search, summarizer
+
+# The same cues the agent prompts route on.
+SEARCH_PATTERN = re.compile(
+    r"https?://|www\.|\b(current|currently|now|presently|latest|recent|recently|"
+    r"today|news)\b"
+)
+SUMMARY_PATTERN = re.compile(
+    r"\b(summary|summaries|summari[sz]e|report|brief|overview|tl;?dr)\b"
+)
+
+
+class GraphMode(StrEnum):
+    AGENTIC = "agentic"
+    FAST = "fast"
+
+
+class Route(StrEnum):
+    RAG = "rag"
+    SEARCH = "search"
+    SUMMARIZE = "summarize"
+
+
+# Questions without a keyword cue go to the route of the most similar example.
+ROUTE_EXAMPLES = {
+    Route.RAG: [
+        "What does the manual say about error code E-1023?",
+        "How do I configure the device according to the documentation?",
+        "Which section describes the warranty terms?",
+        "What are the requirements listed in the policy?",
+    ],
+    Route.SEARCH: [
+        "What is the price of bitcoin?",
+        "Who won the football match yesterday?",
+        "What is the weather like in Paris?",
+        "Which company announced layoffs this week?",
+    ],
+    Route.SUMMARIZE: [
+        "Give me the key points of the uploaded files.",
+        "What is this document about?",
+        "Describe the main ideas of the documents.",
+        "What are the main takeaways of the files?",
+    ],
+}
+
+_route_embeddings: dict[Route, np.ndarray] | None = None
+
+
+class FastSteps(StrEnum):
+    CLASSIFY = "classify"
+    RETRIEVE = "fast_retrieve"
+    ANSWER = "fast_answer"
+    WEB_SEARCH = "fast_web_search"
+    SUMMARIZE = "fast_summarize"
+
+
+class FastState(State):
+    route: Route = Route.RAG
+    # Embedding of the question computed while classifying, reused by retrieval.
+    question_embedding: list[float] | None = None
+
+
+def route_by_keywords(question: str) -> Route | None:
+    text = question.lower()
+    if SEARCH_PATTERN.search(text):
+        return Route.SEARCH
+    if SUMMARY_PATTERN.search(text):
+        return Route.SUMMARIZE
+    return None
+
+
+async def get_route_embeddings() -> dict[Route, np.ndarray]:
+    from backend import QUERY_EMBEDDER
+
+    global _route_embeddings
+    if _route_embeddings is None:
+        embeddings = await asyncio.gather(
+            *(
+                asyncio.gather(*(QUERY_EMBEDDER.embed(example) for example in examples))
+                for examples in ROUTE_EXAMPLES.values()
+            )
+        )
+        _route_embeddings = {
+            route: np.stack([RetrievalCache.normalize(e) for e in route_embeddings])
+            for route, route_embeddings in zip(ROUTE_EXAMPLES, embeddings)
+        }
+    return _route_embeddings
+
+
+async def route_by_similarity(embedding: list[float]) -> Route:
+    question = RetrievalCache.normalize(embedding)
+    similarities = {
+        route: float(np.max(examples @ question))
+        for route, examples in (await get_route_embeddings()).items()
+    }
+    route = max(similarities, key=lambda r: similarities[r])
+    metrics.observe("fast.route_similarity", similarities[route])
+    if similarities[route] < settings.retrieval_settings.FAST_ROUTE_THRESHOLD:
+        return Route.RAG
+    return route
+
+
+async def classify_question(state: FastState):
+    """Picks the route with keyword rules, then by example similarity. No LLM call."""
+    from backend import QUERY_EMBEDDER
+
+    route = route_by_keywords(state.question)
+    embedding = None
+    if route is None:
+        with metrics.timer("fast.classify"):
+            embedding = await QUERY_EMBEDDER.embed(state.question)
+            route = await route_by_similarity(embedding)
+    logger.info(f"Fast path routed to {route}")
+    metrics.increment(f"fast.route.{route}")
+    return {"route": route, "question_embedding": embedding}
+
+
+def answered(state: FastState, answer: str):
+    return {
+        "answer": answer,
+        "messages": [HumanMessage(content=state.question), AIMessage(content=answer)],
+    }
+
+
+async def fast_retrieve(state: FastState):
+    docs = await retrieve_documents(
+        state.user_id,
+        state.knowledge_names,
+        state.question,
+        embedding=state.question_embedding,
+    )
+    return {"docs": docs, "question_embedding": None}
+
+
+async def fast_answer(state: FastState):
+    from backend import get_sratchpad_from_messages
+
+    scratchpad = await get_sratchpad_from_messages(
+        state.messages, state.history_summary, state.summarized_turns
+    )
+    prompt = FAST_RAG_PROMPT.format(
+        question=state.question, docs=format_docs(state.docs), scratchpad=scratchpad
+    )
+    response = await get_llm("fast_answer").ainvoke(prompt)
+    observe_llm_usage("fast_answer", prompt, response)
+    return answered(state, str(response.content))
+
+
+async def fast_web_search(state: FastState):
+    return answered(state, await search.ainvoke({"question": state.question}))
+
+
+async def fast_summarize(state: FastState):
+    answer = await summarizer.ainvoke(
+        {
+            "question": state.question,
+            "knowledge_names": state.knowledge_names,
+            "user_id": state.user_id,
+        }
+    )
+    return answered(state, answer)
+
+
+def build_fast_graph() -> CompiledStateGraph:
+    """
+    RAG without LLM routing: the question is classified by keyword rules or embedding
+    similarity, then answered by a single LLM call over the retrieved documents, a web
+    search or the document summaries. Follow-up questions are still reformulated.
+    """
+    from backend import reformulate_question
+
+    workflow = StateGraph(FastState)
+
+    workflow.add_node(Steps.REFOMRULATE, reformulate_question)
+    workflow.add_node(FastSteps.CLASSIFY, classify_question)
+    workflow.add_node(FastSteps.RETRIEVE, fast_retrieve)
+    workflow.add_node(FastSteps.ANSWER, fast_answer)
+    workflow.add_node(FastSteps.WEB_SEARCH, fast_web_search)
+    workflow.add_node(FastSteps.SUMMARIZE, fast_summarize)
+
+    workflow.set_entry_point(Steps.REFOMRULATE)
+    workflow.add_edge(Steps.REFOMRULATE, FastSteps.CLASSIFY)
+    workflow.add_conditional_edges(
+        FastSteps.CLASSIFY,
+        lambda state: state.route,
+        {
+            Route.RAG: FastSteps.RETRIEVE,
+            Route.SEARCH: FastSteps.WEB_SEARCH,
+            Route.SUMMARIZE: FastSteps.SUMMARIZE,
+        },
+    )
+    workflow.add_edge(FastSteps.RETRIEVE, FastSteps.ANSWER)
+    workflow.add_edge(FastSteps.ANSWER, END)
+    workflow.add_edge(FastSteps.WEB_SEARCH, END)
+    workflow.add_edge(FastSteps.SUMMARIZE, END)
+    return workflow.compile()
@@ -0,0 +1,213 @@
+import asyncio
+import re
+from functools import lru_cache
+from typing import Any
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+
+from llm import get_llm
+from logger import logger
+from metrics import metrics
+from prompts import HISTORY_SUMMARY_PROMPT
+from settings import settings
+
+# Rough size of a token for the fallback estimate when no tokenizer can be loaded.
+CHARS_PER_TOKEN = 4
+
+# Words that point back into the conversation, a question using them is rewritten.
+REFERENCE_WORDS = frozenset(
+    "it its itself this that these those they them their he him his she her there "
+    "above previous earlier before last same again also too else more other another "
+    "former latter one ones".split()
+)
+FOLLOW_UP_OPENINGS = ("and ", "but ", "so ", "what about", "how about", "why not")
+MIN_SELF_CONTAINED_WORDS = 4
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Any | None:
+    try:
+        from transformers import AutoTokenizer  # type:ignore
+
+        return AutoTokenizer.from_pretrained(settings.history_settings.TOKENIZER_NAME)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable ({e}), estimating token counts.")
+        return None
+
+
+async def load_tokenizer() -> None:
+    """Loads the tokenizer off the event loop, the token counters then find it cached."""
+    if not get_tokenizer.cache_info().currsize:
+        await asyncio.to_thread(get_tokenizer)
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[: max_tokens * CHARS_PER_TOKEN] + " ..."
+    ids = tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+    return tokenizer.decode(ids) + " ..."
+
+
+def is_self_contained(question: str) -> bool:
+    """
+    Cheap check whether a question can be answered without the conversation: long
+    enough and free of references to earlier turns. References are recognised in
+    English only, questions with non-ASCII text are always reformulated.
+    """
+    text = question.strip().lower()
+    if not text.isascii() or text.startswith(FOLLOW_UP_OPENINGS):
+        return False
+    words = re.findall(r"[a-z0-9][a-z0-9'-]*", text)
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    return not any(word in REFERENCE_WORDS for word in words)
+
+
+def split_turns(
+    messages: list[AnyMessage],
+) -> tuple[list[list[AnyMessage]], list[AnyMessage]]:
+    """
+    Finished turns and the messages of the turn in progress. A turn ends with the
+    final answer, an AI message without tool calls. The copy of a tool's answer that
+    the post processor adds after the question, right behind the tool message, does
+    not end it.
+    """
+    turns: list[list[AnyMessage]] = []
+    current: list[AnyMessage] = []
+    for message in messages:
+        current.append(message)
+        tool_answer_copy = (
+            len(current) >= 3
+            and isinstance(current[-2], HumanMessage)
+            and isinstance(current[-3], ToolMessage)
+        )
+        if (
+            isinstance(message, AIMessage)
+            and not message.tool_calls
+            and not tool_answer_copy
+        ):
+            turns.append(current)
+            current = []
+    return turns, current
+
+
+def render_message(message: AnyMessage) -> str:
+    if isinstance(message, HumanMessage):
+        text = f"\nUser(Human) Asked : {message.content}\n"
+    elif isinstance(message, ToolMessage):
+        text = f"\nTool Result of {message.name} tool: {message.content}"
+    elif isinstance(message, AIMessage) and message.tool_calls:
+        text = f"\nTool Called : {message.tool_calls[0]['name']}\n"
+    else:
+        text = f"\nAssistant(AI) Message : {message.content}\n"
+    # A single huge tool result must not crowd every other message out.
+    return truncate_to_tokens(text, settings.history_settings.MAX_MESSAGE_TOKENS)
+
+
+def build_scratchpad(
+    messages: list[AnyMessage], summary: str = "", summarized_turns: int = 0
+) -> str:
+    """
+    Conversation history for a prompt, within `MAX_HISTORY_TOKENS`. The budget goes to
+    the turn in progress first, then to the rolling summary of older turns, then to
+    the last `RECENT_TURNS` finished turns, newest first, as long as whole turns fit.
+    The parts are joined once, in conversation order.
+    """
+    history_settings = settings.history_settings
+    budget = history_settings.MAX_HISTORY_TOKENS
+    turns, current = split_turns(messages)
+
+    current_parts: list[str] = []
+    for message in reversed(current):
+        text = render_message(message)
+        tokens = count_tokens(text)
+        if tokens > budget:
+            break
+        current_parts.append(text)
+        budget -= tokens
+    current_parts.reverse()
+
+    summary_part = ""
+    if summary:
+        summary_part = f"\nSummary of the earlier conversation : {summary}\n"
+        tokens = count_tokens(summary_part)
+        if tokens > budget:
+            summary_part = ""
+        else:
+            budget -= tokens
+
+    turn_parts: list[str] = []
+    window = turns[summarized_turns:][-history_settings.RECENT_TURNS :]
+    for turn in reversed(window):
+        text = "".join(render_message(message) for message in turn)
+        tokens = count_tokens(text)
+        if tokens > budget:
+            break
+        turn_parts.append(text)
+        budget -= tokens
+    turn_parts.reverse()
+
+    metrics.observe("history.tokens", history_settings.MAX_HISTORY_TOKENS - budget)
+    metrics.observe("history.turns", len(turns))
+    return "".join([summary_part, *turn_parts, *current_parts])
+
+
+async def update_history_summary(
+    messages: list[AnyMessage], summary: str, summarized_turns: int
+) -> dict[str, Any]:
+    """
+    Folds finished turns that left the `RECENT_TURNS` window into the rolling summary.
+    At most `MAX_HISTORY_TOKENS` of turns are folded per call, so a long backlog is
+    caught up over several turns instead of in one oversized prompt.
+    """
+    history_settings = settings.history_settings
+    if not history_settings.SUMMARIZE_HISTORY:
+        return {}
+    turns, _ = split_turns(messages)
+    window_start = max(summarized_turns, len(turns) - history_settings.RECENT_TURNS)
+    stale = turns[summarized_turns:window_start]
+    if not stale:
+        return {}
+
+    await load_tokenizer()
+    parts: list[str] = []
+    budget = history_settings.MAX_HISTORY_TOKENS
+    folded = 0
+    for turn in stale:
+        text = "".join(render_message(message) for message in turn)
+        tokens = count_tokens(text)
+        if parts and tokens > budget:
+            break
+        parts.append(text)
+        budget -= tokens
+        folded += 1
+
+    try:
+        response = await get_llm("history_summary").ainvoke(
+            HISTORY_SUMMARY_PROMPT.format(
+                summary=summary or "None", conversation="".join(parts)
+            )
+        )
+    except Exception as e:
+        # The summary is an optimisation, the previous one is kept and these turns
+        # are folded on a later call.
+        logger.warning(f"History summary failed: {e}")
+        metrics.increment("history.summary_failures")
+        return {}
+    metrics.increment("history.folded_turns", folded)
+    return {
+        "history_summary": truncate_to_tokens(
+            str(response.content), history_settings.SUMMARY_MAX_TOKENS
+        ),
+        "summarized_turns": summarized_turns + folded,
+    }
@@ -0,0 +1,455 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any
+
+from langchain_community.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+from extraction import PageRange, iter_page_ranges
+from logger import logger
+from metrics import metrics
+from settings import settings
+from bm25 import BM25_FILE_NAME, BM25Index
+from exact_vectors import EXACT_VECTORS_FILE_NAME, ExactVectorStore
+from ann import (
+    Compression,
+    IndexType,
+    choose_compression,
+    choose_index_type,
+    compression_of,
+    default_index_params,
+    index_type_of,
+    rebuild_index,
+    reconstruct_all,
+    remove_vectors,
+)
+from text_store import TextStore, iter_stored_page_ranges
+from vectorstores import (
+    StorageMode,
+    load_vectorstore,
+    read_vectorstore_meta,
+    save_vectorstore,
+    write_index_version,
+)
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@dataclass
+class IndexPlan:
+    """Differences between the files on disk and the files recorded in the manifest."""
+
+    added: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+
+    @property
+    def to_embed(self) -> list[str]:
+        return self.added + self.updated
+
+    @property
+    def to_delete(self) -> list[str]:
+        return self.updated + self.removed
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+
+def compute_file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def empty_manifest() -> dict[str, Any]:
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def load_manifest(manifest_path: str) -> dict[str, Any]:
+    if not os.path.exists(manifest_path):
+        return empty_manifest()
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: dict[str, Any]) -> None:
+    # Written to a temporary file first so a crash never leaves a half-written manifest.
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_index_changes(
+    manifest_files: dict[str, dict[str, Any]], current_hashes: dict[str, str]
+) -> IndexPlan:
+    plan = IndexPlan()
+    for file_name, file_hash in sorted(current_hashes.items()):
+        entry = manifest_files.get(file_name)
+        if entry is None:
+            plan.added.append(file_name)
+        elif entry.get("hash") != file_hash:
+            plan.updated.append(file_name)
+        else:
+            plan.skipped.append(file_name)
+    plan.removed = sorted(set(manifest_files) - set(current_hashes))
+    return plan
+
+
+def chunk_ids_for(
+    manifest_files: dict[str, dict[str, Any]], files: list[str]
+) -> list[str]:
+    return [
+        chunk_id
+        for file_name in files
+        for chunk_id in manifest_files.get(file_name, {}).get("chunk_ids", [])
+    ]
+
+
+@dataclass
+class IndexProgress:
+    files_total: int
+    files_done: int = 0
+    pages_processed: int = 0
+    chunks_embedded: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def as_dict(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "pages_processed": self.pages_processed,
+            "chunks_embedded": self.chunks_embedded,
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": (
+                round(self.chunks_embedded / elapsed, 2) if elapsed > 0 else 0.0
+            ),
+        }
+
+
+def iter_chunks(
+    page_ranges: Iterable[PageRange],
+    splitter: TextSplitter,
+    progress: IndexProgress,
+    failed: set[str],
+    pages_per_file: dict[str, int],
+) -> Iterator[Document]:
+    # Worker time spent extracting each file, summed over its page ranges.
+    extraction_seconds: dict[str, float] = {}
+    for page_range in page_ranges:
+        file_name = page_range.file_name
+        extraction_seconds[file_name] = (
+            extraction_seconds.get(file_name, 0.0) + page_range.elapsed_seconds
+        )
+        if page_range.last:
+            progress.files_done += 1
+            seconds = extraction_seconds.pop(file_name)
+            # Files read back from the text store were not extracted.
+            if seconds > 0:
+                metrics.observe("extraction.file", seconds)
+                logger.info(f"Extracted {file_name} in {seconds:.2f}s")
+        if page_range.error is not None:
+            logger.error(f"Error opening {page_range.file_name}: {page_range.error}")
+            failed.add(page_range.file_name)
+            continue
+        progress.pages_processed += len(page_range.pages)
+        pages_per_file[page_range.file_name] = pages_per_file.get(
+            page_range.file_name, 0
+        ) + len(page_range.pages)
+        # The splitter works page by page, so splitting a page range at a time yields
+        # exactly the chunks a whole-corpus split would.
+        yield from splitter.split_documents(page_range.pages)
+
+
+def iter_batches(
+    items: Iterable[Document], batch_size: int
+) -> Iterator[list[Document]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def backfill_lexical(store: FAISS, lexical: BM25Index) -> None:
+    doc_ids = list(store.index_to_docstore_id.values())
+    for start in range(0, len(doc_ids), settings.indexing_settings.EMBED_BATCH_SIZE):
+        batch = doc_ids[start : start + settings.indexing_settings.EMBED_BATCH_SIZE]
+        docs = [store.docstore.search(doc_id) for doc_id in batch]
+        lexical.add(batch, [doc.page_content for doc in docs])  # type:ignore
+
+
+def backfill_exact_vectors(store: FAISS, exact: ExactVectorStore) -> None:
+    if compression_of(store.index) != Compression.NONE:
+        logger.warning(
+            "Backfilling exact vectors from a compressed index, re-ranking uses "
+            "approximations until the affected files are re-indexed."
+        )
+    vectors = reconstruct_all(store.index)
+    doc_ids = [doc_id for _, doc_id in sorted(store.index_to_docstore_id.items())]
+    batch_size = settings.indexing_settings.EMBED_BATCH_SIZE
+    for start in range(0, len(doc_ids), batch_size):
+        exact.add(
+            doc_ids[start : start + batch_size], vectors[start : start + batch_size]
+        )
+
+
+def index_knowledge(
+    docs_path: str,
+    vs_path: str,
+    manifest_path: str,
+    embeddings: Embeddings,
+    on_progress: Callable[[dict[str, Any]], None] | None = None,
+    index_type: str | None = None,
+    compression: str | None = None,
+    text_store_path: str | None = None,
+) -> dict[str, Any]:
+    """
+    Streams new and changed PDFs through pages -> chunks -> embedding batches -> index.add.
+    Only one embedding batch and a bounded window of extracted pages are held in memory at
+    a time, so peak memory is set by `EMBED_BATCH_SIZE` rather than by the corpus size.
+    With `text_store_path`, page text already extracted for a file version is read back
+    from the text store instead of parsing the PDF again.
+    """
+    start_time = time.perf_counter()
+    all_files = os.listdir(docs_path)
+    pdf_files = [f for f in all_files if f.lower().endswith(".pdf")]
+
+    # A manifest without its vectorstore is meaningless, start from scratch then.
+    vs_exists = os.path.exists(os.path.join(vs_path, "index.faiss"))
+    manifest = load_manifest(manifest_path) if vs_exists else empty_manifest()
+    manifest_files: dict[str, dict[str, Any]] = manifest["files"]
+
+    if not pdf_files and not manifest_files:
+        return {"success": False, "status": "failed", "message": "No PDF files found."}
+
+    current_hashes = {
+        pdf: compute_file_hash(os.path.join(docs_path, pdf)) for pdf in pdf_files
+    }
+    plan = plan_index_changes(manifest_files, current_hashes)
+
+    storage_mode = StorageMode(settings.indexing_settings.STORAGE_MODE)
+    meta = read_vectorstore_meta(vs_path) if vs_exists else {}
+    requested_type = IndexType(
+        index_type or meta.get("index_type") or settings.indexing_settings.INDEX_TYPE
+    )
+    stored_type = IndexType(meta.get("resolved_index_type", IndexType.FLAT))
+    chunk_count = len(chunk_ids_for(manifest_files, list(manifest_files)))
+    index_params: dict[str, int] = meta.get("index_params") or default_index_params(
+        stored_type, chunk_count
+    )
+    requested_compression = Compression(
+        compression or meta.get("compression") or settings.indexing_settings.COMPRESSION
+    )
+    stored_compression = Compression(meta.get("resolved_compression", Compression.NONE))
+    # Compressed indexes keep full-precision vectors on disk for re-ranking.
+    keep_exact = (
+        requested_compression != Compression.NONE
+        and settings.indexing_settings.KEEP_EXACT_VECTORS
+    )
+    has_lexical = os.path.exists(os.path.join(vs_path, BM25_FILE_NAME))
+    has_exact = os.path.exists(os.path.join(vs_path, EXACT_VECTORS_FILE_NAME))
+    needs_rewrite = vs_exists and (
+        not has_lexical
+        or keep_exact != has_exact
+        or meta.get("storage_mode") != storage_mode
+        or meta.get("index_type", IndexType.FLAT) != requested_type
+        or choose_index_type(requested_type, chunk_count) != stored_type
+        or meta.get("compression", Compression.NONE) != requested_compression
+        or choose_compression(requested_compression, chunk_count) != stored_compression
+    )
+
+    if not plan.has_changes and not needs_rewrite:
+        logger.info("FAISS index is up to date, nothing to re-embed.")
+        return {
+            "success": True,
+            "status": "succeeded",
+            "message": "All files indexed.",
+            "added": 0,
+            "updated": 0,
+            "removed": 0,
+            "skipped": len(plan.skipped),
+            "failed": 0,
+            "elapsed_seconds": round(time.perf_counter() - start_time, 3),
+        }
+
+    faiss_index = (
+        load_vectorstore(vs_path, embeddings, read_only=False)
+        if vs_exists and manifest_files
+        else None
+    )
+
+    lexical = BM25Index.open_for_update(vs_path, exists=faiss_index is not None)
+    if faiss_index is not None and lexical.is_empty():
+        # Stores indexed before the lexical index existed are backfilled from their
+        # docstore, which needs no re-embedding.
+        backfill_lexical(faiss_index, lexical)
+
+    exact = (
+        ExactVectorStore.open_for_update(vs_path, exists=faiss_index is not None)
+        if keep_exact
+        else None
+    )
+    if (
+        exact is not None
+        and faiss_index is not None
+        and exact.count() < faiss_index.index.ntotal
+    ):
+        backfill_exact_vectors(faiss_index, exact)
+
+    stale_ids = chunk_ids_for(manifest_files, plan.to_delete)
+    if faiss_index is not None and stale_ids:
+        remove_vectors(faiss_index, stale_ids, index_params, exact)
+        lexical.remove(stale_ids)
+        if exact is not None:
+            exact.remove(stale_ids)
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=800,
+        chunk_overlap=150,
+    )
+    progress = IndexProgress(files_total=len(plan.to_embed))
+    failed: set[str] = set()
+    pages_per_file: dict[str, int] = {}
+    chunk_ids_per_file: dict[str, list[str]] = {pdf: [] for pdf in plan.to_embed}
+
+    files = [(pdf, os.path.join(docs_path, pdf)) for pdf in plan.to_embed]
+    text_store = TextStore(text_store_path) if text_store_path else None
+    if text_store is not None:
+        text_store.retain(pdf_files)
+    chunks = iter_chunks(
+        (
+            iter_stored_page_ranges(text_store, files, current_hashes)
+            if text_store is not None
+            else iter_page_ranges(files)
+        ),
+        splitter,
+        progress,
+        failed,
+        pages_per_file,
+    )
+    for batch in iter_batches(chunks, settings.indexing_settings.EMBED_BATCH_SIZE):
+        texts = [chunk.page_content for chunk in batch]
+        metadatas = [chunk.metadata for chunk in batch]
+        ids = [str(uuid.uuid4()) for _ in batch]
+        vectors = embeddings.embed_documents(texts)
+
+        if faiss_index is None:
+            faiss_index = FAISS.from_embeddings(
+                list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids
+            )
+        else:
+            faiss_index.add_embeddings(
+                list(zip(texts, vectors)), metadatas=metadatas, ids=ids
+            )
+        lexical.add(ids, texts)
+        if exact is not None:
+            exact.add(ids, vectors)
+
+        for chunk_id, metadata in zip(ids, metadatas):
+            chunk_ids_per_file[metadata["file_name"]].append(chunk_id)
+
+        progress.chunks_embedded += len(batch)
+        logger.info(f"Indexing progress: {progress.as_dict()}")
+        if on_progress is not None:
+            on_progress(progress.as_dict())
+
+    if text_store is not None:
+        text_store.close()
+
+    # Files that failed half-way must not leave orphaned chunks behind.
+    orphaned_ids = [
+        chunk_id for pdf in failed for chunk_id in chunk_ids_per_file.get(pdf, [])
+    ]
+    if faiss_index is not None and orphaned_ids:
+        remove_vectors(faiss_index, orphaned_ids, index_params, exact)
+        lexical.remove(orphaned_ids)
+        if exact is not None:
+            exact.remove(orphaned_ids)
+
+    indexed = [pdf for pdf in plan.to_embed if pdf not in failed]
+    for pdf in plan.to_delete:
+        manifest_files.pop(pdf, None)
+    for pdf in indexed:
+        manifest_files[pdf] = {
+            "hash": current_hashes[pdf],
+            "pages": pages_per_file.get(pdf, 0),
+            "chunk_ids": chunk_ids_per_file[pdf],
+        }
+
+    if faiss_index is not None:
+        # New chunks always go into the current index, the index type and compression
+        # are re-evaluated once the final chunk count is known.
+        resolved_type = choose_index_type(requested_type, faiss_index.index.ntotal)
+        resolved_compression = choose_compression(
+            requested_compression, faiss_index.index.ntotal
+        )
+        if faiss_index.index.ntotal and (
+            resolved_type != index_type_of(faiss_index.index)
+            or resolved_compression != compression_of(faiss_index.index)
+        ):
+            index_params = default_index_params(resolved_type, faiss_index.index.ntotal)
+            rebuild_index(
+                faiss_index, resolved_type, index_params, resolved_compression, exact
+            )
+
+        save_vectorstore(
+            faiss_index,
+            vs_path,
+            storage_mode,
+            meta={
+                "index_type": requested_type,
+                "resolved_index_type": index_type_of(faiss_index.index),
+                "index_params": index_params,
+                "compression": requested_compression,
+                "resolved_compression": compression_of(faiss_index.index),
+            },
+        )
+        lexical.save(vs_path)
+        if exact is not None:
+            exact.save(vs_path)
+        elif has_exact:
+            os.remove(os.path.join(vs_path, EXACT_VECTORS_FILE_NAME))
+        save_manifest(manifest_path, manifest)
+        write_index_version(vs_path)
+        logger.info("FAISS index built and saved.")
+
+    # Nothing indexed while files failed is a failure, some of each is a partial run.
+    if failed and not indexed:
+        status = "failed"
+        message = f"No file could be indexed, {len(failed)} failed."
+    elif failed:
+        status = "partial"
+        message = f"{len(failed)} of {len(plan.to_embed)} files failed to index."
+    else:
+        status = "succeeded"
+        message = "All files indexed."
+    return {
+        "success": status != "failed",
+        "status": status,
+        "message": message,
+        "failed_files": sorted(failed),
+        "added": len([f for f in plan.added if f not in failed]),
+        "updated": len([f for f in plan.updated if f not in failed]),
+        "removed": len(plan.removed),
+        "skipped": len(plan.skipped),
+        "failed": len(failed),
+        "progress": progress.as_dict(),
+        "elapsed_seconds": round(time.perf_counter() - start_time, 3),
+    }
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from enum import StrEnum
+from typing import Any
+
+from pydantic import BaseModel
+
+from backend import index_all_pdfs
+from logger import logger
+from settings import settings
+
+
+class JobState(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    PARTIAL = "partial"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class IndexCancelled(Exception):
+    """Raised from the progress callback to stop a running index job at shutdown."""
+
+
+class IndexJob(BaseModel):
+    job_id: str
+    knowledge_name: str
+    user_id: str
+    index_type: str | None = None
+    compression: str | None = None
+    state: JobState = JobState.QUEUED
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    merged_requests: int = 0
+    progress: dict[str, Any] = {}
+    result: dict[str, Any] | None = None
+    error: str | None = None
+
+
+class IndexJobScheduler:
+    """
+    Runs indexing jobs in the background. At most `MAX_CONCURRENT_JOBS` jobs run at once,
+    jobs for the same knowledge base never run concurrently, and a request for a knowledge
+    base that already has a queued job is merged into that job instead of queueing another.
+    """
+
+    def __init__(self, max_concurrent_jobs: int, max_finished_jobs: int) -> None:
+        self.max_finished_jobs = max_finished_jobs
+        self.semaphore = asyncio.Semaphore(max_concurrent_jobs)
+        self.jobs: OrderedDict[str, IndexJob] = OrderedDict()
+        self.queued: dict[tuple[str, str], IndexJob] = {}
+        self.locks: dict[tuple[str, str], asyncio.Lock] = {}
+        self.lock_waiters: Counter[tuple[str, str]] = Counter()
+        self.tasks: set[asyncio.Task] = set()
+        # Read from the indexing threads, which stop at their next embedding batch.
+        self.closing = threading.Event()
+
+    def submit(
+        self,
+        knowledge_name: str,
+        user_id: str,
+        index_type: str | None = None,
+        compression: str | None = None,
+    ) -> IndexJob:
+        if self.closing.is_set():
+            raise RuntimeError("The service is shutting down, no new index jobs.")
+        key = (user_id, knowledge_name)
+        if (job := self.queued.get(key)) is not None:
+            job.merged_requests += 1
+            job.index_type = index_type or job.index_type
+            job.compression = compression or job.compression
+            logger.info(f"Merged index request into queued job {job.job_id}")
+            return job
+
+        job = IndexJob(
+            job_id=str(uuid.uuid4()),
+            knowledge_name=knowledge_name,
+            user_id=user_id,
+            index_type=index_type,
+            compression=compression,
+            created_at=time.time(),
+        )
+        self.jobs[job.job_id] = job
+        self.queued[key] = job
+        task = asyncio.create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> IndexJob | None:
+        return self.jobs.get(job_id)
+
+    async def _run(self, job: IndexJob) -> None:
+        key = (job.user_id, job.knowledge_name)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.lock_waiters[key] += 1
+        try:
+            await self._run_locked(job, lock)
+        finally:
+            self.lock_waiters[key] -= 1
+            if not self.lock_waiters[key]:
+                del self.lock_waiters[key]
+                del self.locks[key]
+
+    async def _run_locked(self, job: IndexJob, lock: asyncio.Lock) -> None:
+        key = (job.user_id, job.knowledge_name)
+        # The per knowledge base lock is taken first so a waiting job never holds a slot.
+        async with lock, self.semaphore:
+            self.queued.pop(key, None)
+            if self.closing.is_set():
+                job.state = JobState.CANCELLED
+                job.error = "Cancelled at shutdown before it started."
+                job.finished_at = time.time()
+                return
+            job.state = JobState.RUNNING
+            job.started_at = time.time()
+            logger.info(f"Index job {job.job_id} started for {job.knowledge_name}")
+
+            def on_progress(progress: dict[str, Any]) -> None:
+                job.progress = progress
+                if self.closing.is_set():
+                    # Nothing has been swapped in yet, the live index stays untouched.
+                    raise IndexCancelled("Cancelled at shutdown.")
+
+            try:
+                result = await index_all_pdfs(
+                    knowledge_name=job.knowledge_name,
+                    user_id=job.user_id,
+                    on_progress=on_progress,
+                    index_type=job.index_type,
+                    compression=job.compression,
+                )
+            except IndexCancelled as e:
+                job.state = JobState.CANCELLED
+                job.error = str(e)
+            except asyncio.CancelledError:
+                job.state = JobState.CANCELLED
+                job.error = "Cancelled at shutdown."
+                raise
+            except Exception as e:
+                logger.error(f"Index job {job.job_id} failed: {e}")
+                job.state = JobState.FAILED
+                job.error = str(e)
+            else:
+                job.result = result
+                job.progress = result.get("progress", job.progress)
+                # Some files may have failed while the others were indexed.
+                job.state = JobState(result.get("status", JobState.FAILED))
+                if job.state != JobState.SUCCEEDED:
+                    job.error = result.get("message")
+            finally:
+                job.finished_at = time.time()
+                logger.info(f"Index job {job.job_id} finished: {job.state}")
+
+    def _prune(self) -> None:
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.state
+            in (
+                JobState.SUCCEEDED,
+                JobState.PARTIAL,
+                JobState.FAILED,
+                JobState.CANCELLED,
+            )
+        ]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    async def close(self, timeout: float) -> None:
+        """
+        Stops taking jobs and waits for the submitted ones. Queued jobs are cancelled,
+        running ones stop at their next embedding batch without touching the live
+        index. Jobs still running after `timeout` seconds are cancelled.
+        """
+        self.closing.set()
+        if not self.tasks:
+            return
+        _, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"Cancelling {len(pending)} index jobs still running")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+index_job_scheduler = IndexJobScheduler(
+    max_concurrent_jobs=settings.indexing_settings.MAX_CONCURRENT_JOBS,
+    max_finished_jobs=settings.indexing_settings.MAX_FINISHED_JOBS,
+)
@@ -0,0 +1,233 @@
+import asyncio
+import random
+import time
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from typing import Any
+
+import httpx
+import openai
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+
+from llm_cache import LLMResponseCache
+from logger import logger
+from metrics import metrics
+from settings import settings
+
+# Failures worth another attempt: the server was unreachable, timed out, rate limited
+# the request or broke while handling it. Anything else is a bug in the request.
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+LLM_CACHE = LLMResponseCache(
+    path=settings.models_settings.CACHE_PATH,
+    max_bytes=settings.models_settings.CACHE_MAX_BYTES,
+    memory_entries=settings.models_settings.CACHE_MEMORY_ENTRIES,
+    ttl_seconds=settings.models_settings.CACHE_TTL_SECONDS,
+)
+
+
+class LLMPool:
+    """
+    Process-wide state shared by every LLM call: one keep-alive HTTP connection pool,
+    one `ChatOpenAI` per resolved model configuration and a semaphore bounding the
+    requests in flight to the model servers.
+    """
+
+    def __init__(self) -> None:
+        models_settings = settings.models_settings
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(models_settings.MAX_IN_FLIGHT)
+        self.in_flight = 0
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=models_settings.MAX_CONNECTIONS,
+                max_keepalive_connections=models_settings.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=models_settings.KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=models_settings.TIMEOUT_SECONDS,
+        )
+        self.models: dict[tuple[str, float, str, str], ChatOpenAI] = {}
+        # Cacheable calls currently waiting on the model server, by cache key.
+        self.pending: dict[str, asyncio.Task[BaseMessage]] = {}
+
+    def model_for(self, call_site: str) -> ChatOpenAI:
+        models_settings = settings.models_settings
+        override = models_settings.CALL_SITE_MODELS.get(call_site)
+        config = (
+            (override and override.MODEL_NAME) or models_settings.MODEL_NAME,
+            (
+                override.TEMPERATURE
+                if override and override.TEMPERATURE is not None
+                else models_settings.TEMPERATURE
+            ),
+            (override and override.BASE_URL) or models_settings.BASE_URL,
+            (override and override.API_KEY) or models_settings.API_KEY,
+        )
+        if config not in self.models:
+            model_name, temperature, base_url, api_key = config
+            self.models[config] = ChatOpenAI(
+                model=model_name,
+                temperature=temperature,
+                base_url=base_url,
+                api_key=api_key,  # type:ignore
+                http_async_client=self.http_client,
+                # Retries are handled by `LLMClient`, outside the in-flight limit.
+                max_retries=0,
+                # Token usage is still reported when the answer is streamed.
+                stream_usage=True,
+            )
+        return self.models[config]
+
+    @asynccontextmanager
+    async def slot(self, call_site: str) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        async with self.semaphore:
+            metrics.observe(
+                f"llm.queue_wait.{call_site}", time.perf_counter() - started
+            )
+            self.in_flight += 1
+            metrics.observe("llm.in_flight", self.in_flight)
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def aclose(self) -> None:
+        # Shared requests nobody waits for any more would outlive the HTTP client.
+        tasks = list(self.pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.http_client.aclose()
+
+
+_pool: LLMPool | None = None
+
+
+def get_llm_pool() -> LLMPool:
+    global _pool
+    # The HTTP connections and the semaphore belong to one event loop.
+    if _pool is None or _pool.loop is not asyncio.get_running_loop():
+        _pool = LLMPool()
+    return _pool
+
+
+async def close_llm_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
+
+
+class LLMClient:
+    """
+    Chat model for one call site. Calls wait for a slot of the shared in-flight limit
+    and are retried with exponential backoff and jitter on transient server errors.
+    Call sites listed in `CACHE_CALL_SITES` answer temperature-0 calls from
+    `LLM_CACHE`, and concurrent identical calls share one request.
+    """
+
+    def __init__(self, call_site: str, runnable: Runnable | None = None) -> None:
+        self.call_site = call_site
+        self.runnable = runnable
+
+    def bind_tools(self, tools: Sequence[Any]) -> "LLMClient":
+        return LLMClient(
+            self.call_site,
+            get_llm_pool().model_for(self.call_site).bind_tools(tools),
+        )
+
+    def cache_key(self, runnable: Runnable, prompt: LanguageModelInput) -> str | None:
+        models_settings = settings.models_settings
+        model = get_llm_pool().model_for(self.call_site)
+        if (
+            not models_settings.CACHE_ENABLED
+            or self.call_site not in models_settings.CACHE_CALL_SITES
+            or model.temperature
+        ):
+            return None
+        params = {
+            "temperature": model.temperature,
+            "base_url": model.openai_api_base,
+            # Bound tools and options of `bind_tools`.
+            **getattr(runnable, "kwargs", {}),
+        }
+        return LLMResponseCache.make_key(model.model_name, params, prompt)
+
+    async def ainvoke(self, prompt: LanguageModelInput) -> BaseMessage:
+        pool = get_llm_pool()
+        runnable = self.runnable or pool.model_for(self.call_site)
+        key = self.cache_key(runnable, prompt)
+        if key is None:
+            return await self.call(pool, runnable, prompt)
+
+        cached = await asyncio.to_thread(LLM_CACHE.get, key)
+        if cached is not None:
+            metrics.increment("llm_cache.hits")
+            metrics.increment(f"llm_cache.hits.{self.call_site}")
+            # Callers may modify the message, the cached one must stay intact.
+            return cached.model_copy(deep=True)
+        task = pool.pending.get(key)
+        if task is not None:
+            metrics.increment("llm_cache.hits")
+            metrics.increment(f"llm_cache.hits.{self.call_site}")
+            metrics.increment("llm_cache.shared")
+        else:
+            metrics.increment("llm_cache.misses")
+            metrics.increment(f"llm_cache.misses.{self.call_site}")
+            # The request runs in its own task, a caller that is cancelled only stops
+            # waiting and the others still get the response.
+            task = asyncio.create_task(self.fetch(pool, runnable, prompt, key))
+            pool.pending[key] = task
+
+            def done(task: asyncio.Task[BaseMessage]) -> None:
+                if pool.pending.get(key) is task:
+                    del pool.pending[key]
+                # Nobody may be waiting, do not warn about an unretrieved exception.
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(done)
+        response = await asyncio.shield(task)
+        return response.model_copy(deep=True)
+
+    async def fetch(
+        self, pool: LLMPool, runnable: Runnable, prompt: LanguageModelInput, key: str
+    ) -> BaseMessage:
+        response = await self.call(pool, runnable, prompt)
+        await asyncio.to_thread(LLM_CACHE.put, key, response)
+        return response
+
+    async def call(
+        self, pool: LLMPool, runnable: Runnable, prompt: LanguageModelInput
+    ) -> BaseMessage:
+        max_retries = settings.models_settings.MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            try:
+                async with pool.slot(self.call_site):
+                    with metrics.timer(f"llm.latency.{self.call_site}"):
+                        return await runnable.ainvoke(prompt)
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    metrics.increment(f"llm.failures.{self.call_site}")
+                    raise
+                delay = settings.models_settings.RETRY_BACKOFF_SECONDS * 2**attempt
+                delay *= 0.5 + random.random()
+                metrics.increment(f"llm.retries.{self.call_site}")
+                logger.warning(
+                    f"LLM call {self.call_site} failed ({e}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+def get_llm(call_site: str) -> LLMClient:
+    """Shared chat model for `call_site`, honouring its `CALL_SITE_MODELS` override."""
+    return LLMClient(call_site)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from logger import logger
+from metrics import metrics
+
+# After an eviction the disk tier is trimmed to this fraction of its budget so that
+# evictions do not run on every single insert once it is full.
+EVICTION_TARGET_RATIO = 0.9
+
+
+class LLMResponseCache:
+    """
+    Responses of deterministic LLM calls keyed by model, call parameters and prompt
+    hash. A small in-memory LRU sits in front of a SQLite tier that survives restarts.
+    Entries expire after `ttl_seconds` and the least recently used disk entries are
+    evicted once the stored responses exceed `max_bytes`.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int, memory_entries: int, ttl_seconds: float
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory: OrderedDict[str, tuple[float, BaseMessage]] = OrderedDict()
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses(last_access)"
+        )
+        self.conn.commit()
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses")
+        self.total_bytes: int = row.fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, params: dict[str, Any], prompt: Any) -> str:
+        payload = json.dumps(
+            {"model": model_name, "params": params, "prompt": prompt},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> BaseMessage | None:
+        now = time.time()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None and now - cached[0] <= self.ttl_seconds:
+                self.memory.move_to_end(key)
+                metrics.increment("llm_cache.memory_hits")
+                return cached[1]
+            row = self.conn.execute(
+                "SELECT response, size, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            response, size, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.total_bytes -= size
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            message = messages_from_dict([json.loads(response)])[0]
+            self._remember(key, created_at, message)
+        metrics.increment("llm_cache.disk_hits")
+        return message
+
+    def put(self, key: str, message: BaseMessage) -> None:
+        now = time.time()
+        response = json.dumps(message_to_dict(message))
+        with self.lock:
+            self._remember(key, now, message)
+            cursor = self.conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response), now, now),
+            )
+            self.conn.commit()
+            self.total_bytes += len(response) - (cursor[0] if cursor else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _remember(self, key: str, created_at: float, message: BaseMessage) -> None:
+        self.memory[key] = (created_at, message)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        to_free = self.total_bytes - target
+        freed = 0
+        keys: list[str] = []
+        cursor = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        )
+        for key, size in cursor:
+            if freed >= to_free:
+                break
+            keys.append(key)
+            freed += size
+        self.conn.executemany(
+            "DELETE FROM responses WHERE key = ?", [(k,) for k in keys]
+        )
+        self.conn.commit()
+        for key in keys:
+            self.memory.pop(key, None)
+        self.total_bytes -= freed
+        metrics.increment("llm_cache.evictions", len(keys))
+        logger.info(f"LLM cache evicted {len(keys)} entries ({freed} bytes)")
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            memory_entries = len(self.memory)
+        return {
+            "entries": entries,
+            "memory_entries": memory_entries,
+            "size_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hit_rate": metrics.ratio("llm_cache.hits", "llm_cache.misses"),
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -1,7 +1,24 @@
+from contextlib import asynccontextmanager
+
 from router import router
 from fastapi import FastAPI
 
-app = FastAPI()
+from resources import AppResources
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Graphs, checkpointer and warm models are shared by every request.
+    resources = AppResources()
+    app.state.resources = resources
+    await resources.start()
+    try:
+        yield
+    finally:
+        await resources.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(router, prefix="/rag", tags=["RAG"])
 
@@ -1,7 +1,6 @@
 from typing import Annotated
 
 from enum import StrEnum
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
 from langgraph.graph.message import add_messages
 
@@ -19,17 +18,25 @@ from tools import (
     tool_query,
 )
 from prompts import AGENT_PROMPT
+from metrics import observe_llm_usage
+from llm import get_llm
+from retrieval import Speculation
 from settings import settings
 
 
 class State(BaseModel):
-    knowledge_name: str
+    knowledge_names: list[str]
     user_id: str
     question: str
     docs: list[Document]
     answer: str | None = None
     messages: Annotated[list[AnyMessage], add_messages] = []
     agent_response: AIMessage | None = None
+    # Rolling summary of the finished turns before the recent-turns window.
+    history_summary: str = ""
+    summarized_turns: int = 0
+    # Retrieval started on the raw question while it was reformulated.
+    speculation: Speculation | None = None
 
 
 class Steps(StrEnum):
@@ -45,11 +52,14 @@ class Steps(StrEnum):
 async def retrieve_post_processor(state: State):
     last_message = state.messages[-1]
     if isinstance(last_message, ToolMessage):
-        texts = last_message.content
-        docs = [Document(page_content=text) for text in texts]  # type:ignore
+        docs = last_message.artifact or []
 
+        # The documents move into `docs`, the message keeps its summary only, so they
+        # are checkpointed once.
         return {
             "docs": docs,
+            "messages": [last_message.model_copy(update={"artifact": None})],
+            "speculation": None,
         }
 
     else:
@@ -75,19 +85,12 @@ async def post_processor_main(state: State):
 async def agent_node(state: State):
     from backend import get_sratchpad_from_messages
 
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
-    )
-    if model is None:
-        raise RuntimeError("Model not available ")
-
     tools = [retrieve, search, query]
 
-    model = model.bind_tools(tools)  # type:ignore
-    scratchpad = await get_sratchpad_from_messages(state.messages)
+    model = get_llm("agent_node").bind_tools(tools)
+    scratchpad = await get_sratchpad_from_messages(
+        state.messages, state.history_summary, state.summarized_turns
+    )
 
     prompt = AGENT_PROMPT.format(
         question=state.question,
@@ -95,20 +98,35 @@ async def agent_node(state: State):
         docs=state.docs if len(state.docs) > 0 else [],
     )
     response = await model.ainvoke(prompt)
-    return {
+    observe_llm_usage("agent_node", prompt, response)
+    update = {
         "agent_response": response,
         "messages": [response],
         "answer": response.content,
         # "agent_number_of_calls": state.agent_number_of_calls + 1,  # type:ignore
     }
+    # The turn ends here unless a tool is called, an unused speculation is not checkpointed.
+    if response.content != "" or not response.tool_calls:
+        update["speculation"] = None
+    return update
 
 
-def build_graph() -> CompiledStateGraph:
-    from backend import reformulate_question
+def build_graph(speculative: bool | None = None) -> CompiledStateGraph:
+    """
+    The agentic RAG graph. In speculative mode retrieval on the raw question starts
+    together with its reformulation, see `speculative_reformulate_question`.
+    """
+    from backend import reformulate_question, speculative_reformulate_question
+
+    if speculative is None:
+        speculative = settings.retrieval_settings.SPECULATIVE_RETRIEVAL
 
     workflow = StateGraph(State)
 
-    workflow.add_node(Steps.REFOMRULATE, reformulate_question)
+    workflow.add_node(
+        Steps.REFOMRULATE,
+        speculative_reformulate_question if speculative else reformulate_question,
+    )
     workflow.add_node(Steps.AGENT_NODE, agent_node)
     workflow.add_node(Steps.QUERY, tool_query)
     workflow.add_node(Steps.RETRIEVE, tool_retrieve)
@@ -141,8 +159,8 @@ def build_graph() -> CompiledStateGraph:
             ):
                 logger.info("Retrieve tool triggered")
                 last_message.tool_calls[0]["args"][  # type:ignore
-                    "knowledge_name"
-                ] = state.knowledge_name
+                    "knowledge_names"
+                ] = state.knowledge_names
                 last_message.tool_calls[0]["args"][  # type:ignore
                     "user_id"
                 ] = state.user_id
@@ -154,14 +172,11 @@ def build_graph() -> CompiledStateGraph:
             ):
                 logger.info("Query tool triggered")
                 last_message.tool_calls[0]["args"][  # type:ignore
-                    "knowledge_name"
-                ] = state.knowledge_name
+                    "knowledge_names"
+                ] = state.knowledge_names
                 last_message.tool_calls[0]["args"][  # type:ignore
                     "user_id"
                 ] = state.user_id
-                last_message.tool_calls[0]["args"][  # type:ignore
-                    "docs"
-                ] = state.docs
 
                 return Steps.QUERY  # tool
 
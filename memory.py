@@ -24,20 +24,30 @@ CHAT_HISTORY_DB_URI = CHAT_HISTORY_DB_URI_TEMPLATE.format(
 
 class Memory:
     memory = None
+    connection: AsyncConnection | None = None
 
     @classmethod
     async def initialize_memory(cls):
         if cls.memory is None:
             cls.create_database()
-            cls.verify_connection()
+            cls.verify_connection().close()
 
             pool = await AsyncConnection.connect(CHAT_HISTORY_DB_URI, autocommit=True)
+            cls.connection = pool
             cls.memory = AsyncPostgresSaver(pool)  # type: ignore
 
             await cls.memory.setup()
 
         return cls.memory
 
+    @classmethod
+    async def close_memory(cls):
+        if cls.connection is not None:
+            await cls.connection.close()
+            logger.info("Chat history connection closed")
+        cls.connection = None
+        cls.memory = None
+
     @staticmethod
     def create_database() -> Connection:
         try:
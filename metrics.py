@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+MAX_SAMPLES = 1024
+
+
+class Metrics:
+    """Process-wide counters and latency samples, exposed through `GET /rag/metrics`."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: dict[str, float] = {}
+        self.samples: dict[str, deque[float]] = {}
+        self.totals: dict[str, tuple[int, float]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=MAX_SAMPLES)).append(value)
+            count, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (count + 1, total + value)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def ratio(self, hits: str, misses: str) -> float:
+        with self.lock:
+            hit_count = self.counters.get(hits, 0)
+            total = hit_count + self.counters.get(misses, 0)
+        return round(hit_count / total, 4) if total else 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            counters = dict(self.counters)
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            totals = dict(self.totals)
+
+        summaries: dict[str, dict[str, float]] = {}
+        for name, values in samples.items():
+            count, total = totals[name]
+            summaries[name] = {
+                "count": count,
+                "mean": round(total / count, 6),
+                "p50": round(values[len(values) // 2], 6),
+                "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 6),
+                "max": round(values[-1], 6),
+            }
+        return {"counters": counters, "timings": summaries}
+
+
+metrics = Metrics()
+
+
+def observe_llm_usage(call_site: str, prompt: str, response: Any) -> None:
+    """Records prompt size and, when the server reports it, input token count."""
+    metrics.observe(f"llm.prompt_chars.{call_site}", len(prompt))
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        metrics.observe(f"llm.input_tokens.{call_site}", usage["input_tokens"])
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from fastapi import HTTPException, Request
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
+
+from ask_graph import get_ask_graph
+from backend import (
+    EMBED_MODEL,
+    EMBEDDING_CACHE,
+    build_rag_graph,
+    resolve_graph_mode,
+)
+from extraction import shutdown_extraction_executor
+from fast_graph import GraphMode, get_route_embeddings
+from history import load_tokenizer
+from jobs import index_job_scheduler
+from llm import LLM_CACHE, close_llm_pool
+from logger import logger
+from memory import Memory
+from metrics import metrics
+from retrieval import shutdown_search_executor
+from settings import settings
+
+
+class AppResources:
+    """
+    Process-wide state the app lifespan opens once and hands to request handlers: the
+    chat history checkpointer and the compiled graphs. The embedding model and the history
+    tokenizer are warmed in the background, `ready` turns true once that has finished.
+    """
+
+    def __init__(self) -> None:
+        self.checkpointer: BaseCheckpointSaver | None = None
+        self.rag_graphs: dict[GraphMode, CompiledStateGraph] = {}
+        self.ready = False
+        self.warmup_error: str | None = None
+        self.warmup_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        started = time.perf_counter()
+        self.checkpointer = await Memory.initialize_memory()
+        for mode in GraphMode:
+            rag_graph = build_rag_graph(mode)
+            rag_graph.checkpointer = self.checkpointer
+            self.rag_graphs[mode] = rag_graph
+        get_ask_graph()
+        metrics.observe("startup.graphs", time.perf_counter() - started)
+        self.warmup_task = asyncio.create_task(self.warm_up())
+
+    async def warm_up(self) -> None:
+        started = time.perf_counter()
+        try:
+            # Loads the model and runs the first, slowest forward pass.
+            await asyncio.to_thread(EMBED_MODEL.warmup)
+            await load_tokenizer()
+            await get_route_embeddings()
+        except Exception as e:
+            # The service still answers, the first requests pay for the model load.
+            logger.error(f"Warmup failed: {str(e)}")
+            self.warmup_error = str(e)
+            return
+        metrics.observe("startup.warmup", time.perf_counter() - started)
+        logger.info(f"Warmup finished in {time.perf_counter() - started:.2f}s")
+        self.ready = True
+
+    def rag_graph(self, mode: GraphMode | None = None) -> CompiledStateGraph:
+        return self.rag_graphs[resolve_graph_mode(mode)]
+
+    async def close(self) -> None:
+        self.ready = False
+        if self.warmup_task is not None and not self.warmup_task.done():
+            self.warmup_task.cancel()
+        # Index jobs use the pools and caches closed below.
+        await index_job_scheduler.close(
+            settings.indexing_settings.SHUTDOWN_TIMEOUT_SECONDS
+        )
+        await close_llm_pool()
+        await Memory.close_memory()
+        shutdown_search_executor()
+        shutdown_extraction_executor()
+        LLM_CACHE.close()
+        EMBEDDING_CACHE.close()
+        self.rag_graphs.clear()
+        self.checkpointer = None
+
+
+def get_resources(request: Request) -> AppResources:
+    resources: AppResources | None = getattr(request.app.state, "resources", None)
+    if resources is None or not resources.rag_graphs:
+        raise HTTPException(status_code=503, detail="The service is starting up.")
+    return resources
@@ -0,0 +1,298 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_community.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from pydantic import BaseModel
+
+from bm25 import BM25Index
+from exact_vectors import ExactVectorStore, rerank
+from metrics import metrics
+from settings import settings
+from vectorstores import read_index_version
+
+_executor: ThreadPoolExecutor | None = None
+
+
+@dataclass
+class KnowledgeHits:
+    """Dense and lexical candidates of one knowledge base, doc IDs tagged with its name."""
+
+    knowledge_name: str
+    store: FAISS
+    dense: list[tuple[tuple[str, str], float]] = field(default_factory=list)
+    lexical: list[tuple[tuple[str, str], float]] | None = None
+
+
+class Speculation(BaseModel):
+    """Documents retrieved for the raw question while it was being reformulated."""
+
+    question: str
+    docs: list[Document]
+    # Retrieval time that ran in the shadow of the reformulation call.
+    hidden_seconds: float
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # FAISS and SQLite release the GIL while searching, so threads run in parallel.
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.retrieval_settings.SEARCH_WORKERS,
+            thread_name_prefix="retrieval",
+        )
+    return _executor
+
+
+def shutdown_search_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_search_executor(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        get_search_executor(), func, *args
+    )
+
+
+def dense_search(
+    store: FAISS,
+    embedding: list[float],
+    k: int,
+    exact: ExactVectorStore | None = None,
+) -> list[tuple[str, float]]:
+    """
+    Searches the FAISS index. Compressed indexes with exact vectors on disk fetch
+    `RERANK_FACTOR` times more candidates and re-rank them by exact distance.
+    """
+    rerank_factor = settings.retrieval_settings.RERANK_FACTOR
+    if exact is None or rerank_factor <= 1:
+        fetch = k
+    else:
+        fetch = k * rerank_factor
+    with metrics.timer("retrieval.dense"):
+        vector = np.asarray([embedding], dtype=np.float32)
+        distances, positions = store.index.search(vector, fetch)
+        candidates = [
+            (store.index_to_docstore_id[position], float(distance))
+            for distance, position in zip(distances[0], positions[0])
+            if position != -1
+        ]
+    if fetch == k:
+        return candidates
+    with metrics.timer("retrieval.rerank"):
+        return rerank(candidates, exact, embedding, k)  # type:ignore
+
+
+def lexical_search(
+    lexical: BM25Index, question: str, k: int
+) -> list[tuple[str, float]]:
+    with metrics.timer("retrieval.lexical"):
+        return lexical.search(question, k)
+
+
+def reciprocal_rank_fusion(
+    rankings: list[tuple[list[tuple[tuple[str, str], float]], float]], rrf_k: int
+) -> list[tuple[tuple[str, str], float]]:
+    """Fuses ranked `(doc_id, score)` lists, each with a weight, by reciprocal rank."""
+    fused: dict[tuple[str, str], float] = {}
+    for ranking, weight in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+async def search_knowledge(
+    user_id: str,
+    knowledge_name: str,
+    question: str,
+    embedding: list[float],
+    candidates: int,
+    hybrid: bool,
+) -> KnowledgeHits:
+    from backend import EMBED_MODEL, VECTORSTORE_CACHE, get_vs_path
+
+    vs_path = get_vs_path(knowledge_name=knowledge_name, user_id=user_id)
+    cached = await VECTORSTORE_CACHE.aget(
+        (user_id, knowledge_name), vs_path, EMBED_MODEL
+    )
+    searches = [
+        run_in_search_executor(
+            dense_search, cached.store, embedding, candidates, cached.exact
+        )
+    ]
+    if hybrid and cached.lexical is not None:
+        searches.append(
+            run_in_search_executor(lexical_search, cached.lexical, question, candidates)
+        )
+    results = await asyncio.gather(*searches)
+
+    hits = KnowledgeHits(knowledge_name=knowledge_name, store=cached.store)
+    hits.dense = [((knowledge_name, doc_id), score) for doc_id, score in results[0]]
+    if len(results) > 1:
+        hits.lexical = [
+            ((knowledge_name, doc_id), score) for doc_id, score in results[1]
+        ]
+    return hits
+
+
+def merge_hits(
+    hits: list[KnowledgeHits], hybrid: bool
+) -> list[tuple[tuple[str, str], float]]:
+    """
+    Merges the candidates of all knowledge bases into one ranking. Dense distances come
+    from the same embedding model and are compared directly (smaller is closer), as are
+    BM25 scores (larger is better); the two global rankings are then fused by reciprocal
+    rank.
+    """
+    retrieval_settings = settings.retrieval_settings
+    dense = sorted(
+        (candidate for knowledge in hits for candidate in knowledge.dense),
+        key=lambda item: item[1],
+    )
+    lexical = sorted(
+        (candidate for knowledge in hits for candidate in knowledge.lexical or []),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    if not hybrid or not lexical:
+        return dense
+    with metrics.timer("retrieval.fusion"):
+        return reciprocal_rank_fusion(
+            [
+                (dense, retrieval_settings.DENSE_WEIGHT),
+                (lexical, retrieval_settings.LEXICAL_WEIGHT),
+            ],
+            rrf_k=retrieval_settings.RRF_K,
+        )
+
+
+async def retrieve_documents(
+    user_id: str,
+    knowledge_names: list[str],
+    question: str,
+    k: int | None = None,
+    embedding: list[float] | None = None,
+) -> list[Document]:
+    """
+    Runs dense FAISS search and BM25 lexical search over every knowledge base
+    concurrently and merges the candidates into one global top-k, each document tagged
+    with its source `knowledge_name`. Falls back to dense search alone for knowledge
+    bases indexed before the lexical index existed or when hybrid search is disabled.
+    Near-duplicate questions are answered from the semantic retrieval cache.
+    """
+    from backend import QUERY_EMBEDDER, RETRIEVAL_CACHE, get_vs_path
+
+    started = time.perf_counter()
+    retrieval_settings = settings.retrieval_settings
+    knowledge_names = list(dict.fromkeys(knowledge_names))
+    k = k or retrieval_settings.TOP_K
+    candidates = max(k, retrieval_settings.CANDIDATES)
+    hybrid = retrieval_settings.HYBRID_ENABLED
+    key = (user_id, ",".join(knowledge_names))
+
+    async def embed_question() -> list[float]:
+        if embedding is not None:
+            return embedding
+        with metrics.timer("retrieval.embed"):
+            return await QUERY_EMBEDDER.embed(question)
+
+    async def read_versions() -> str:
+        versions = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    read_index_version,
+                    get_vs_path(knowledge_name=name, user_id=user_id),
+                )
+                for name in knowledge_names
+            )
+        )
+        return "|".join(str(version) for version in versions)
+
+    version, question_embedding = await asyncio.gather(
+        read_versions(), embed_question()
+    )
+
+    if retrieval_settings.SEMANTIC_CACHE_ENABLED:
+        cached_documents = RETRIEVAL_CACHE.get(key, version, question_embedding, k)
+        if cached_documents is not None:
+            metrics.observe("retrieval.total", time.perf_counter() - started)
+            return cached_documents
+
+    hits = await asyncio.gather(
+        *(
+            search_knowledge(
+                user_id, name, question, question_embedding, candidates, hybrid
+            )
+            for name in knowledge_names
+        )
+    )
+    ranked = merge_hits(list(hits), hybrid)
+    stores = {knowledge.knowledge_name: knowledge.store for knowledge in hits}
+
+    doc_ids = []
+    documents = []
+    for (knowledge_name, doc_id), _ in ranked[:k]:
+        doc = stores[knowledge_name].docstore.search(doc_id)
+        if isinstance(doc, Document):
+            doc_ids.append(doc_id)
+            documents.append(
+                doc.model_copy(
+                    update={
+                        "metadata": {**doc.metadata, "knowledge_name": knowledge_name}
+                    }
+                )
+            )
+    if retrieval_settings.SEMANTIC_CACHE_ENABLED:
+        # Keyed by the versions read before searching, so a concurrent re-index can only
+        # make this entry stale, never serve it against the new index.
+        RETRIEVAL_CACHE.put(key, version, question_embedding, k, doc_ids, documents)
+    metrics.observe("retrieval.knowledge_bases", len(knowledge_names))
+    metrics.observe("retrieval.total", time.perf_counter() - started)
+    return documents
+
+
+async def retrieve_with_speculation(
+    user_id: str,
+    knowledge_names: list[str],
+    question: str,
+    speculation: Speculation | None,
+) -> list[Document]:
+    """
+    Reuses the documents retrieved speculatively for the raw question when the question
+    the agent asks is semantically close to it (cosine similarity of at least
+    `SPECULATION_THRESHOLD`), otherwise retrieves again.
+    """
+    from backend import QUERY_EMBEDDER, RETRIEVAL_CACHE
+
+    if speculation is None:
+        return await retrieve_documents(user_id, knowledge_names, question)
+
+    embedding = None
+    if question == speculation.question:
+        similarity = 1.0
+    else:
+        with metrics.timer("retrieval.embed"):
+            embedding, speculative_embedding = await asyncio.gather(
+                QUERY_EMBEDDER.embed(question),
+                QUERY_EMBEDDER.embed(speculation.question),
+            )
+        similarity = float(
+            RETRIEVAL_CACHE.normalize(embedding)
+            @ RETRIEVAL_CACHE.normalize(speculative_embedding)
+        )
+    metrics.observe("speculation.similarity", similarity)
+
+    if similarity >= settings.retrieval_settings.SPECULATION_THRESHOLD:
+        metrics.increment("speculation.hits")
+        metrics.observe("speculation.saved", speculation.hidden_seconds)
+        return list(speculation.docs)
+    metrics.increment("speculation.misses")
+    return await retrieve_documents(
+        user_id, knowledge_names, question, embedding=embedding
+    )
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+from langchain_community.docstore.document import Document
+
+from metrics import metrics
+
+
+# Entries are compared by identity, comparing their embedding arrays is ambiguous.
+@dataclass(eq=False)
+class CachedRetrieval:
+    embedding: np.ndarray
+    k: int
+    doc_ids: list[str]
+    documents: list[Document]
+    created_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class KnowledgeRetrievals:
+    version: str | None
+    entries: list[CachedRetrieval] = field(default_factory=list)
+
+
+class RetrievalCache:
+    """
+    Per knowledge base cache of recent question embeddings and the chunks retrieved for
+    them. A new question is served from the cache when its cosine similarity to a cached
+    question is at least `threshold`. Entries expire after `ttl_seconds`, are dropped when
+    the knowledge base's index version changes, and the least recently used knowledge
+    bases are evicted once more than `max_entries` questions are cached in total.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        ttl_seconds: float,
+        max_entries: int,
+        max_per_knowledge: int,
+    ) -> None:
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_per_knowledge = max_per_knowledge
+        self.knowledges: OrderedDict[tuple[str, str], KnowledgeRetrievals] = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(
+        self,
+        key: tuple[str, str],
+        version: str | None,
+        embedding: list[float],
+        k: int,
+    ) -> list[Document] | None:
+        question = self.normalize(embedding)
+        with self.lock:
+            knowledge = self._live(key, version)
+            if knowledge is None:
+                metrics.increment("retrieval_cache.misses")
+                return None
+            candidates = [entry for entry in knowledge.entries if entry.k == k]
+            if not candidates:
+                metrics.increment("retrieval_cache.misses")
+                return None
+            similarities = (
+                np.stack([entry.embedding for entry in candidates]) @ question
+            )
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                metrics.increment("retrieval_cache.misses")
+                return None
+            entry = candidates[best]
+            # Most recently served entries move to the back and are evicted last.
+            knowledge.entries.remove(entry)
+            knowledge.entries.append(entry)
+            self.knowledges.move_to_end(key)
+        metrics.increment("retrieval_cache.hits")
+        metrics.observe("retrieval_cache.similarity", float(similarities[best]))
+        return list(entry.documents)
+
+    def put(
+        self,
+        key: tuple[str, str],
+        version: str | None,
+        embedding: list[float],
+        k: int,
+        doc_ids: list[str],
+        documents: list[Document],
+    ) -> None:
+        entry = CachedRetrieval(
+            embedding=self.normalize(embedding),
+            k=k,
+            doc_ids=list(doc_ids),
+            documents=list(documents),
+        )
+        with self.lock:
+            knowledge = self._live(key, version)
+            if knowledge is None:
+                knowledge = KnowledgeRetrievals(version=version)
+                self.knowledges[key] = knowledge
+            knowledge.entries.append(entry)
+            del knowledge.entries[: -self.max_per_knowledge]
+            self.knowledges.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key: tuple[str, str]) -> None:
+        with self.lock:
+            self.knowledges.pop(key, None)
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            entries = sum(len(k.entries) for k in self.knowledges.values())
+            knowledges = len(self.knowledges)
+        return {
+            "entries": entries,
+            "knowledge_bases": knowledges,
+            "hit_rate": metrics.ratio("retrieval_cache.hits", "retrieval_cache.misses"),
+        }
+
+    def _live(
+        self, key: tuple[str, str], version: str | None
+    ) -> KnowledgeRetrievals | None:
+        """The unexpired entries of a knowledge base, dropped when none are left."""
+        knowledge = self.knowledges.get(key)
+        if knowledge is None:
+            return None
+        expires_before = time.monotonic() - self.ttl_seconds
+        knowledge.entries = [
+            entry for entry in knowledge.entries if entry.created_at >= expires_before
+        ]
+        if knowledge.version != version or not knowledge.entries:
+            del self.knowledges[key]
+            return None
+        return knowledge
+
+    def _evict(self) -> None:
+        # Every knowledge base counts as at least one entry, so the map stays bounded.
+        total = sum(max(1, len(k.entries)) for k in self.knowledges.values())
+        while total > self.max_entries and len(self.knowledges) > 1:
+            _, knowledge = self.knowledges.popitem(last=False)
+            total -= max(1, len(knowledge.entries))
+            metrics.increment("retrieval_cache.evictions", len(knowledge.entries))
@@ -1,8 +1,22 @@
 from fastapi import APIRouter, HTTPException
-from fastapi import APIRouter, File, HTTPException, UploadFile
-from services import process_uploads, index_file, ask_service
+from fastapi import APIRouter, Body, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from services import (
+    process_uploads,
+    index_file,
+    index_job_status,
+    ask_service,
+    ask_stream_service,
+    ask_batch_service,
+    ask_batch_stream_service,
+    check_batch_size,
+    metrics_service,
+)
 from typing import Any
 from logger import logger
+from ann import Compression, IndexType
+from fast_graph import GraphMode
+from resources import AppResources, get_resources
 
 router = APIRouter()
 
@@ -30,22 +44,150 @@ async def upload_files(
 async def index_files(
     knowledge_name: str,
     user_id: str,
+    index_type: IndexType | None = None,
+    compression: Compression | None = None,
 ):
     try:
-        return await index_file(knowledge_name=knowledge_name, user_id=user_id)
+        return await index_file(
+            knowledge_name=knowledge_name,
+            user_id=user_id,
+            index_type=index_type,
+            compression=compression,
+        )
 
     except Exception as e:
         logger.error(f"Indexing failed for {knowledge_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get(
+    "/index-jobs/{job_id}",
+    response_model=dict[str, Any],
+    operation_id="index_job_status_operation",
+)
+async def index_job_router(job_id: str):
+    try:
+        return await index_job_status(job_id=job_id)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Index job lookup failed for {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/ask", response_model=str, operation_id="ask_operation")
-async def ask_router(knowledge_name: str, user_id: str, query: str):
+async def ask_router(
+    user_id: str,
+    query: str,
+    knowledge_name: list[str] = Query(...),
+    mode: GraphMode | None = None,
+    resources: AppResources = Depends(get_resources),
+):
+    # Repeat `knowledge_name` to search several knowledge bases in one ask.
+    # `mode=fast` skips the agent's LLM routing, it defaults to `DEFAULT_GRAPH_MODE`.
     try:
         return await ask_service(
-            knowledge_name=knowledge_name, user_id=user_id, query=query
+            knowledge_names=knowledge_name,
+            user_id=user_id,
+            query=query,
+            mode=mode,
+            rag_graph=resources.rag_graph(mode),
         )
 
     except Exception as e:
         logger.error(f"Ask failed for {knowledge_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/ask/stream", operation_id="ask_stream_operation")
+async def ask_stream_router(
+    user_id: str,
+    query: str,
+    knowledge_name: list[str] = Query(...),
+    mode: GraphMode | None = None,
+    resources: AppResources = Depends(get_resources),
+):
+    # Server-Sent Events: `node` progress, answer `token`s, then the final `answer`.
+    return StreamingResponse(
+        ask_stream_service(
+            knowledge_names=knowledge_name,
+            user_id=user_id,
+            query=query,
+            mode=mode,
+            rag_graph=resources.rag_graph(mode),
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post(
+    "/ask/batch", response_model=dict[str, Any], operation_id="ask_batch_operation"
+)
+async def ask_batch_router(
+    user_id: str,
+    knowledge_name: list[str] = Query(...),
+    mode: GraphMode | None = None,
+    resources: AppResources = Depends(get_resources),
+    queries: list[str] = Body(...),
+):
+    # The body is a JSON list of questions, each answered in a conversation of its own.
+    try:
+        return await ask_batch_service(
+            knowledge_names=knowledge_name,
+            user_id=user_id,
+            queries=queries,
+            mode=mode,
+            rag_graph=resources.rag_graph(mode),
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch ask failed for {knowledge_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/ask/batch/stream", operation_id="ask_batch_stream_operation")
+async def ask_batch_stream_router(
+    user_id: str,
+    knowledge_name: list[str] = Query(...),
+    mode: GraphMode | None = None,
+    resources: AppResources = Depends(get_resources),
+    queries: list[str] = Body(...),
+):
+    # Server-Sent Events: one `result` per question as it finishes, then `done`.
+    check_batch_size(queries)
+    return StreamingResponse(
+        ask_batch_stream_service(
+            knowledge_names=knowledge_name,
+            user_id=user_id,
+            queries=queries,
+            mode=mode,
+            rag_graph=resources.rag_graph(mode),
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/ready", response_model=dict[str, Any], operation_id="ready_operation")
+async def ready_router(resources: AppResources = Depends(get_resources)):
+    # 503 until the graphs are compiled and the embedding model is warm.
+    if not resources.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=resources.warmup_error or "Warming up.",
+        )
+    return {"ready": True}
+
+
+@router.get("/metrics", response_model=dict[str, Any], operation_id="metrics_operation")
+async def metrics_router():
+    try:
+        return await metrics_service()
+
+    except Exception as e:
+        logger.error(f"Metrics failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
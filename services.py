@@ -1,10 +1,26 @@
 from fastapi import UploadFile
+import json
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
 from fastapi import HTTPException, UploadFile
 
 from logger import logger
-from backend import save_uploaded_file, index_all_pdfs, ask
+from backend import (
+    EMBEDDING_CACHE,
+    RETRIEVAL_CACHE,
+    save_uploaded_file,
+    ask,
+    ask_batch,
+    ask_stream,
+)
+from fast_graph import GraphMode
+from langgraph.graph.state import CompiledStateGraph
+from llm import LLM_CACHE
+from metrics import metrics
+from settings import settings
+from jobs import index_job_scheduler
 
 
 async def process_uploads(
@@ -29,18 +45,149 @@ async def process_uploads(
     }
 
 
-async def index_file(knowledge_name: str, user_id: str) -> dict[str, Any]:
+async def index_file(
+    knowledge_name: str,
+    user_id: str,
+    index_type: str | None = None,
+    compression: str | None = None,
+) -> dict[str, Any]:
     try:
-        return await index_all_pdfs(knowledge_name=knowledge_name, user_id=user_id)
+        job = index_job_scheduler.submit(
+            knowledge_name=knowledge_name,
+            user_id=user_id,
+            index_type=index_type,
+            compression=compression,
+        )
+        return job.model_dump()
     except Exception as e:
         logger.error(f"Index failed for {knowledge_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def ask_service(knowledge_name: str, user_id: str, query: str):
+async def index_job_status(job_id: str) -> dict[str, Any]:
+    job = index_job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Index job {job_id} not found.")
+    return job.model_dump()
+
+
+async def metrics_service() -> dict[str, Any]:
+    return {
+        **metrics.snapshot(),
+        "embedding_cache": EMBEDDING_CACHE.stats(),
+        "retrieval_cache": RETRIEVAL_CACHE.stats(),
+        "llm_cache": LLM_CACHE.stats(),
+        "speculation": {
+            "hit_rate": metrics.ratio("speculation.hits", "speculation.misses"),
+        },
+    }
+
+
+async def ask_service(
+    knowledge_names: list[str],
+    user_id: str,
+    query: str,
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+):
+    try:
+        return await ask(
+            knowledge_names=knowledge_names,
+            user_id=user_id,
+            query=query,
+            mode=mode,
+            rag_graph=rag_graph,
+        )
+
+    except Exception as e:
+        logger.error(f"Ask failed for {knowledge_names}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def ask_stream_service(
+    knowledge_names: list[str],
+    user_id: str,
+    query: str,
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> AsyncIterator[str]:
+    """`ask_stream` events as Server-Sent Events."""
     try:
-        return await ask(knowledge_name=knowledge_name, user_id=user_id, query=query)
+        async for event in ask_stream(
+            knowledge_names=knowledge_names,
+            user_id=user_id,
+            query=query,
+            mode=mode,
+            rag_graph=rag_graph,
+        ):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    except Exception as e:
+        # The response has already started, report the failure in the stream.
+        logger.error(f"Ask stream failed for {knowledge_names}: {str(e)}")
+        error = {"event": "error", "detail": str(e)}
+        yield f"event: error\ndata: {json.dumps(error)}\n\n"
 
+
+def check_batch_size(queries: list[str]) -> None:
+    max_questions = settings.retrieval_settings.BATCH_ASK_MAX_QUESTIONS
+    if not queries or len(queries) > max_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch takes 1 to {max_questions} questions, got {len(queries)}.",
+        )
+
+
+async def ask_batch_service(
+    knowledge_names: list[str],
+    user_id: str,
+    queries: list[str],
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> dict[str, Any]:
+    """Every `ask_batch` result, in the order of the questions."""
+    check_batch_size(queries)
+    started = time.perf_counter()
+    try:
+        results = [
+            result
+            async for result in ask_batch(
+                knowledge_names=knowledge_names,
+                user_id=user_id,
+                queries=queries,
+                mode=mode,
+                rag_graph=rag_graph,
+            )
+        ]
     except Exception as e:
-        logger.error(f"Ask failed for {knowledge_name}: {str(e)}")
+        logger.error(f"Batch ask failed for {knowledge_names}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "results": sorted(results, key=lambda result: result["index"]),
+        "total_ms": round((time.perf_counter() - started) * 1000),
+    }
+
+
+async def ask_batch_stream_service(
+    knowledge_names: list[str],
+    user_id: str,
+    queries: list[str],
+    mode: GraphMode | None = None,
+    rag_graph: CompiledStateGraph | None = None,
+) -> AsyncIterator[str]:
+    """`ask_batch` results as Server-Sent Events, as they finish, then `done`."""
+    started = time.perf_counter()
+    try:
+        async for result in ask_batch(
+            knowledge_names=knowledge_names,
+            user_id=user_id,
+            queries=queries,
+            mode=mode,
+            rag_graph=rag_graph,
+        ):
+            yield f"event: result\ndata: {json.dumps(result)}\n\n"
+        done = {"total_ms": round((time.perf_counter() - started) * 1000)}
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+    except Exception as e:
+        logger.error(f"Batch ask stream failed for {knowledge_names}: {str(e)}")
+        error = {"event": "error", "detail": str(e)}
+        yield f"event: error\ndata: {json.dumps(error)}\n\n"
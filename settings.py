@@ -1,24 +1,140 @@
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 import os
 import json
 from typing import Any
 
 
+class ModelOverride(BaseModel):
+    MODEL_NAME: str | None = None
+    TEMPERATURE: float | None = None
+    BASE_URL: str | None = None
+    API_KEY: str | None = None
+
+
 class ModelsSettings(BaseSettings):
     MODEL_NAME: str = "qwen2.5:7b"
     TEMPERATURE: float = 0
     BASE_URL: str = "http://localhost:11434/v1"
     API_KEY: str = "ollama"
+    MAX_IN_FLIGHT: int = 8
+    MAX_CONNECTIONS: int = 32
+    MAX_KEEPALIVE_CONNECTIONS: int = 16
+    KEEPALIVE_EXPIRY_SECONDS: float = 60
+    TIMEOUT_SECONDS: float = 120
+    MAX_RETRIES: int = 3
+    RETRY_BACKOFF_SECONDS: float = 0.5
+    CALL_SITE_MODELS: dict[str, ModelOverride] = {}
+    CACHE_ENABLED: bool = True
+    CACHE_CALL_SITES: list[str] = ["reformulate_question", "search", "doc_related"]
+    CACHE_PATH: str = "cache/llm_responses.sqlite"
+    CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    CACHE_MEMORY_ENTRIES: int = 1024
+    CACHE_TTL_SECONDS: float = 24 * 60 * 60
+
+
+class IndexingSettings(BaseSettings):
+    EXTRACTION_WORKERS: int = max(1, (os.cpu_count() or 2) - 1)
+    PAGES_PER_TASK: int = 16
+    EMBED_BATCH_SIZE: int = 256
+    MAX_CONCURRENT_JOBS: int = 2
+    MAX_FINISHED_JOBS: int = 1000
+    SHUTDOWN_TIMEOUT_SECONDS: float = 30
+    STORAGE_MODE: str = "pickle"
+    INDEX_TYPE: str = "auto"
+    HNSW_MIN_CHUNKS: int = 20_000
+    IVF_MIN_CHUNKS: int = 500_000
+    HNSW_M: int = 32
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64
+    IVF_NLIST: int = 0
+    IVF_NPROBE: int = 16
+    COMPRESSION: str = "none"
+    PQ_M: int = 0
+    PQ_NBITS: int = 8
+    KEEP_EXACT_VECTORS: bool = True
+
+
+class EmbeddingSettings(BaseSettings):
+    MODEL_NAME: str = "Qwen/Qwen3-Embedding-0.6B"
+    DEVICE: str = "auto"
+    NUM_THREADS: int = 0
+    MAX_BATCH_SIZE: int = 64
+    MEMORY_BUDGET_MB: int = 1024
+    QUERY_BATCH_WAIT_MS: float = 5
+    QUERY_MAX_BATCH_SIZE: int = 32
+    QUERY_CACHE_ENTRIES: int = 1024
+    CACHE_PATH: str = "cache/embeddings.sqlite"
+    CACHE_MAX_BYTES: int = 2 * 1024**3
+
+
+class RetrievalSettings(BaseSettings):
+    VECTORSTORE_CACHE_MAX_BYTES: int = 4 * 1024**3
+    NPROBE: int = 0
+    EF_SEARCH: int = 0
+    TOP_K: int = 5
+    CANDIDATES: int = 20
+    HYBRID_ENABLED: bool = True
+    DENSE_WEIGHT: float = 1.0
+    LEXICAL_WEIGHT: float = 1.0
+    RRF_K: int = 60
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    BM25_MAX_DF_RATIO: float = 0.5
+    SEARCH_WORKERS: int = min(32, (os.cpu_count() or 1) + 4)
+    RERANK_FACTOR: int = 4
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL_SECONDS: float = 600
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 10_000
+    SEMANTIC_CACHE_MAX_PER_KNOWLEDGE: int = 256
+    SPECULATIVE_RETRIEVAL: bool = True
+    SPECULATION_THRESHOLD: float = 0.9
+    SKIP_SELF_CONTAINED_REFORMULATION: bool = True
+    DEFAULT_GRAPH_MODE: str = "agentic"
+    FAST_ROUTE_THRESHOLD: float = 0.6
+    BATCH_ASK_CONCURRENCY: int = 8
+    BATCH_ASK_MAX_QUESTIONS: int = 500
+
+
+class SummarySettings(BaseSettings):
+    SUMMARIZE_ON_INDEX: bool = True
+    CHUNK_CHARS: int = 4000
+    CHUNK_OVERLAP: int = 200
+    REDUCE_MAX_CHARS: int = 8000
+    MAX_CONCURRENCY: int = 4
+
+
+class HistorySettings(BaseSettings):
+    TOKENIZER_NAME: str = "Qwen/Qwen2.5-7B-Instruct"
+    MAX_HISTORY_TOKENS: int = 2000
+    MAX_MESSAGE_TOKENS: int = 500
+    RECENT_TURNS: int = 3
+    SUMMARIZE_HISTORY: bool = True
+    SUMMARY_MAX_TOKENS: int = 300
 
 
 class Settings(BaseSettings):
     models_settings: ModelsSettings
+    indexing_settings: IndexingSettings = Field(default_factory=IndexingSettings)
+    embedding_settings: EmbeddingSettings = Field(default_factory=EmbeddingSettings)
+    retrieval_settings: RetrievalSettings = Field(default_factory=RetrievalSettings)
+    summary_settings: SummarySettings = Field(default_factory=SummarySettings)
+    history_settings: HistorySettings = Field(default_factory=HistorySettings)
 
 
-file_name = "models_settings.json"
+file_names = [
+    "models_settings.json",
+    "indexing_settings.json",
+    "embedding_settings.json",
+    "retrieval_settings.json",
+    "summary_settings.json",
+    "history_settings.json",
+]
 config_data: dict[str, Any] = {}
-if os.path.exists(file_name):
-    with open(file_name, "r", encoding="utf-8") as f:
-        key = file_name.replace(".json", "")
-        config_data[key] = json.load(f)
+for file_name in file_names:
+    if os.path.exists(file_name):
+        with open(file_name, "r", encoding="utf-8") as f:
+            key = file_name.replace(".json", "")
+            config_data[key] = json.load(f)
 settings = Settings.model_validate(config_data)
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+from collections import deque
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generator,
+)
+from contextlib import aclosing
+from typing import Any
+
+from langchain_community.docstore.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from indexing import compute_file_hash
+from llm import LLMClient, get_llm
+from logger import logger
+from metrics import metrics
+from prompts import CHUNK_SUMMARY_PROMPT, REDUCE_SUMMARY_PROMPT, SUMMARIZER_PROMPT
+from settings import settings
+from text_store import iter_file_pages
+
+SUMMARIES_FILE_NAME = "summaries.json"
+
+_locks: dict[str, asyncio.Lock] = {}
+
+Summarize = Callable[[str, str], Awaitable[str]]
+
+
+def load_summaries(summaries_path: str) -> dict[str, dict[str, str]]:
+    if not os.path.exists(summaries_path):
+        return {}
+    with open(summaries_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_summaries(summaries_path: str, summaries: dict[str, dict[str, str]]) -> None:
+    os.makedirs(os.path.dirname(summaries_path), exist_ok=True)
+    tmp_path = f"{summaries_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, summaries_path)
+
+
+def limited(model: LLMClient, semaphore: asyncio.Semaphore) -> Summarize:
+    """LLM call that waits for a slot of `semaphore`, timed per stage."""
+
+    async def summarize(prompt: str, stage: str) -> str:
+        async with semaphore:
+            with metrics.timer(f"summary.{stage}"):
+                response = await model.ainvoke(prompt)
+        return str(response.content)
+
+    return summarize
+
+
+def pack(texts: list[str], max_chars: int) -> list[list[str]]:
+    """Groups consecutive texts so every group stays within `max_chars`."""
+    groups: list[list[str]] = []
+    size = 0
+    for text in texts:
+        if groups and size + len(text) <= max_chars:
+            groups[-1].append(text)
+            size += len(text)
+        else:
+            groups.append([text])
+            size = len(text)
+    return groups
+
+
+async def reduce_summaries(
+    summaries: list[str], summarize: Summarize, max_total_chars: int = 0
+) -> list[str]:
+    """
+    Merges summaries in stages, each stage merging groups that fit `REDUCE_MAX_CHARS`
+    concurrently, until one is left or together they fit `max_total_chars`.
+    """
+    max_chars = settings.summary_settings.REDUCE_MAX_CHARS
+    while len(summaries) > 1 and sum(map(len, summaries)) > max_total_chars:
+        groups = pack(summaries, max_chars)
+        if len(groups) == len(summaries):
+            # Every summary alone fills the budget, merge pairs to keep making progress.
+            groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+
+        async def merge(group: list[str]) -> str:
+            if len(group) == 1:
+                return group[0]
+            prompt = REDUCE_SUMMARY_PROMPT.format(summaries="\n\n".join(group))
+            return await summarize(prompt, "reduce")
+
+        summaries = list(await asyncio.gather(*(merge(group) for group in groups)))
+    return summaries
+
+
+async def iter_in_thread(
+    pages: Generator[list[Document], None, None],
+) -> AsyncGenerator[list[Document], None]:
+    """Steps a blocking page generator on worker threads."""
+    try:
+        while (page_range := await asyncio.to_thread(next, pages, None)) is not None:
+            yield page_range
+    finally:
+        await asyncio.to_thread(pages.close)
+
+
+async def summarize_document(
+    file_name: str, page_ranges: AsyncIterator[list[Document]], summarize: Summarize
+) -> str:
+    """
+    Summarizes one document while its pages stream in, then reduces the partial
+    summaries. Text is split as it arrives and only the unsplit tail and a bounded
+    number of pending map calls are held, never the whole document.
+    """
+    summary_settings = settings.summary_settings
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=summary_settings.CHUNK_CHARS,
+        chunk_overlap=summary_settings.CHUNK_OVERLAP,
+    )
+    max_pending = max(1, summary_settings.MAX_CONCURRENCY) * 2
+    pending: deque[asyncio.Task[str]] = deque()
+    partials: list[str] = []
+
+    async def map_chunks(chunks: list[str]) -> None:
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                partials.append(await pending.popleft())
+            pending.append(
+                asyncio.create_task(
+                    summarize(
+                        CHUNK_SUMMARY_PROMPT.format(document=file_name, text=chunk),
+                        "map",
+                    )
+                )
+            )
+
+    tail = ""
+    try:
+        async for pages in page_ranges:
+            text = "\n\n".join(page.page_content for page in pages)
+            tail = f"{tail}\n\n{text}" if tail else text
+            if len(tail) < 2 * summary_settings.CHUNK_CHARS:
+                continue
+            # The last chunk may continue on the next pages, it is split again with them.
+            *complete, tail = splitter.split_text(tail)
+            await map_chunks(complete)
+        await map_chunks(splitter.split_text(tail) if tail else [])
+        while pending:
+            partials.append(await pending.popleft())
+    finally:
+        for task in pending:
+            task.cancel()
+    reduced = await reduce_summaries(partials, summarize)
+    return reduced[0] if reduced else ""
+
+
+async def refresh_summaries(
+    docs_path: str, summaries_path: str, text_store_path: str
+) -> dict[str, Any]:
+    """
+    Brings the stored per-document summaries of a knowledge base in line with its PDFs.
+    New and changed files are summarized, summaries of deleted files are dropped and
+    unchanged files keep their summary. Page text comes from the text store, so files
+    already extracted by indexing are not parsed again.
+    """
+    lock = _locks.setdefault(summaries_path, asyncio.Lock())
+    async with lock:
+        summaries = load_summaries(summaries_path)
+        pdf_files = sorted(
+            f for f in os.listdir(docs_path) if f.lower().endswith(".pdf")
+        )
+        hashes = await asyncio.to_thread(
+            lambda: {
+                pdf: compute_file_hash(os.path.join(docs_path, pdf))
+                for pdf in pdf_files
+            }
+        )
+        removed = [f for f in summaries if f not in hashes]
+        for file_name in removed:
+            summaries.pop(file_name)
+        stale = [f for f in pdf_files if summaries.get(f, {}).get("hash") != hashes[f]]
+        metrics.increment("summary.cache_hits", len(pdf_files) - len(stale))
+        metrics.increment("summary.cache_misses", len(stale))
+
+        summarized: list[str] = []
+        failed: list[str] = []
+        if stale:
+            summarize = limited(
+                get_llm("summarizer"),
+                asyncio.Semaphore(settings.summary_settings.MAX_CONCURRENCY),
+            )
+            # Pages stream in per document and at most MAX_CONCURRENCY documents are
+            # summarized at once, each holding a bounded window of its text.
+            documents = asyncio.Semaphore(settings.summary_settings.MAX_CONCURRENCY)
+
+            async def summarize_file(file_name: str):
+                async with documents:
+                    pages = iter_file_pages(
+                        text_store_path,
+                        file_name,
+                        os.path.join(docs_path, file_name),
+                        hashes[file_name],
+                    )
+                    try:
+                        async with aclosing(iter_in_thread(pages)) as page_ranges:
+                            summary = await summarize_document(
+                                file_name, page_ranges, summarize
+                            )
+                    except Exception as e:
+                        logger.error(f"Summarizing {file_name} failed: {e}")
+                        failed.append(file_name)
+                        return
+                    if not summary:
+                        return
+                summaries[file_name] = {"hash": hashes[file_name], "summary": summary}
+                summarized.append(file_name)
+
+            await asyncio.gather(*(summarize_file(file_name) for file_name in stale))
+        save_summaries(summaries_path, summaries)
+
+    return {
+        "summarized": len(summarized),
+        "reused": len(pdf_files) - len(stale),
+        "removed": len(removed),
+        "failed": len(failed),
+    }
+
+
+async def answer_from_summaries(question: str, summaries: dict[str, str]) -> str:
+    """
+    Answers a summary question from stored per-document summaries. They are reduced in
+    stages only when together they exceed `REDUCE_MAX_CHARS`.
+    """
+    summarize = limited(
+        get_llm("summarizer"),
+        asyncio.Semaphore(settings.summary_settings.MAX_CONCURRENCY),
+    )
+    parts = await reduce_summaries(
+        [f"## {name}\n{summary}" for name, summary in summaries.items()],
+        summarize,
+        max_total_chars=settings.summary_settings.REDUCE_MAX_CHARS,
+    )
+    return await summarize(
+        SUMMARIZER_PROMPT.format(question=question, docs="\n\n".join(parts)), "final"
+    )
@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import threading
+import zlib
+from collections.abc import Generator, Iterator
+from itertools import islice
+
+from langchain_community.docstore.document import Document
+
+from extraction import PageRange, iter_page_ranges
+from metrics import metrics
+from settings import settings
+
+TEXT_STORE_FILE_NAME = "texts.sqlite"
+
+
+class TextStore:
+    """
+    Extracted page text of every PDF in a knowledge base, stored zlib-compressed in
+    `texts.sqlite` next to the manifest and keyed by file name plus file hash. A file
+    is only recorded as complete once all its pages are written, so a half extracted
+    file is never served.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files (file_name TEXT PRIMARY KEY, "
+            "hash TEXT, pages INTEGER);"
+            "CREATE TABLE IF NOT EXISTS pages (file_name TEXT, page INTEGER, "
+            "text BLOB, PRIMARY KEY (file_name, page)) WITHOUT ROWID;"
+        )
+        self.conn.commit()
+
+    def hash_of(self, file_name: str) -> str | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM files WHERE file_name = ?", (file_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def file_names(self) -> list[str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT file_name FROM files").fetchall()
+        return [file_name for (file_name,) in rows]
+
+    def iter_pages(self, file_name: str) -> Iterator[Document]:
+        """Streams the pages of a file in page order, a few at a time."""
+        last_page = 0
+        batch_size = max(1, settings.indexing_settings.PAGES_PER_TASK)
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT page, text FROM pages WHERE file_name = ? AND page > ? "
+                    "ORDER BY page LIMIT ?",
+                    (file_name, last_page, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for page, blob in rows:
+                yield Document(
+                    page_content=zlib.decompress(blob).decode("utf-8"),
+                    metadata={"page": page, "file_name": file_name},
+                )
+            last_page = rows[-1][0]
+
+    def begin(self, file_name: str) -> None:
+        """Drops whatever is stored for a file before its new version is written."""
+        self.remove([file_name])
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO files (file_name, hash, pages) VALUES (?, NULL, 0)",
+                (file_name,),
+            )
+            self.conn.commit()
+
+    def add_pages(self, file_name: str, pages: list[Document]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages (file_name, page, text) VALUES (?, ?, ?)",
+                [
+                    (
+                        file_name,
+                        page.metadata["page"],
+                        zlib.compress(page.page_content.encode("utf-8")),
+                    )
+                    for page in pages
+                ],
+            )
+            self.conn.execute(
+                "UPDATE files SET pages = pages + ? WHERE file_name = ?",
+                (len(pages), file_name),
+            )
+            self.conn.commit()
+
+    def complete(self, file_name: str, file_hash: str) -> None:
+        with self.lock:
+            self.conn.execute(
+                "UPDATE files SET hash = ? WHERE file_name = ?", (file_hash, file_name)
+            )
+            self.conn.commit()
+
+    def remove(self, file_names: list[str]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM pages WHERE file_name = ?",
+                [(file_name,) for file_name in file_names],
+            )
+            self.conn.executemany(
+                "DELETE FROM files WHERE file_name = ?",
+                [(file_name,) for file_name in file_names],
+            )
+            self.conn.commit()
+
+    def retain(self, file_names: list[str]) -> None:
+        """Drops the text of files that are no longer in the knowledge base."""
+        keep = set(file_names)
+        self.remove([f for f in self.file_names() if f not in keep])
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def _read_stored(store: TextStore, file_name: str) -> Iterator[PageRange]:
+    batch_size = max(1, settings.indexing_settings.PAGES_PER_TASK)
+    pages = store.iter_pages(file_name)
+    batch = list(islice(pages, batch_size))
+    if not batch:
+        yield PageRange(file_name=file_name)
+    while batch:
+        following = list(islice(pages, batch_size))
+        yield PageRange(file_name=file_name, pages=batch, last=not following)
+        batch = following
+
+
+def _extract_and_store(
+    store: TextStore, files: list[tuple[str, str]], hashes: dict[str, str]
+) -> Iterator[PageRange]:
+    started: set[str] = set()
+    failed: set[str] = set()
+    for page_range in iter_page_ranges(files):
+        file_name = page_range.file_name
+        if page_range.error is not None:
+            failed.add(file_name)
+            store.remove([file_name])
+        elif file_name not in failed:
+            if file_name not in started:
+                store.begin(file_name)
+                started.add(file_name)
+            store.add_pages(file_name, page_range.pages)
+            if page_range.last:
+                store.complete(file_name, hashes[file_name])
+        yield page_range
+
+
+def iter_stored_page_ranges(
+    store: TextStore,
+    files: list[tuple[str, str]],
+    hashes: dict[str, str],
+) -> Iterator[PageRange]:
+    """
+    Drop-in for `iter_page_ranges`. Files whose current version is in `store` are read
+    back from it, the others are extracted on the process pool and written to `store`
+    as they stream through. Files come out in input order, consecutive files that need
+    extracting share one pass over the pool.
+    """
+    missing: list[tuple[str, str]] = []
+    for file_name, pdf_full_path in files:
+        if store.hash_of(file_name) != hashes[file_name]:
+            missing.append((file_name, pdf_full_path))
+            continue
+        if missing:
+            yield from _extract_and_store(store, missing, hashes)
+            metrics.increment("text_store.misses", len(missing))
+            missing = []
+        metrics.increment("text_store.hits")
+        yield from _read_stored(store, file_name)
+    if missing:
+        yield from _extract_and_store(store, missing, hashes)
+        metrics.increment("text_store.misses", len(missing))
+
+
+def iter_file_pages(
+    store_path: str, file_name: str, pdf_full_path: str, file_hash: str
+) -> Generator[list[Document], None, None]:
+    """
+    Pages of one file, a page range at a time, extracted only when `store_path` has no
+    text for its version. Raises when the file cannot be read.
+    """
+    store = TextStore(store_path)
+    try:
+        for page_range in iter_stored_page_ranges(
+            store, [(file_name, pdf_full_path)], {file_name: file_hash}
+        ):
+            if page_range.error is not None:
+                raise RuntimeError(f"Error opening {file_name}: {page_range.error}")
+            if page_range.pages:
+                yield page_range.pages
+    finally:
+        store.close()
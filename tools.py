@@ -1,17 +1,17 @@
 from logger import logger
-from langchain_community.vectorstores import FAISS
 from typing import Annotated
 from langchain_core.tools import InjectedToolArg, tool
 from langchain_community.docstore.document import Document
 from tavily import TavilyClient  # type:ignore
-from langchain_openai import ChatOpenAI
-from prompts import SEARCH_PROMPT, SUMMARIZER_PROMPT
-from langchain_core.messages import ToolMessage
+from prompts import SEARCH_PROMPT
 from langchain_core.runnables.config import RunnableConfig
+import asyncio
 import os
-from settings import settings
+from context import describe_docs, format_docs
+from llm import get_llm
+from metrics import observe_llm_usage
+from retrieval import Speculation
 
-import fitz  # type:ignore
 from dotenv import load_dotenv
 import os
 
@@ -36,51 +36,64 @@ class BasicToolNode:
             raise ValueError("No message found in input")
         outputs = []
         for tool_call in message.tool_calls:
-            tool_result = await self.tools_by_name[tool_call["name"]].ainvoke(
-                tool_call["args"]
-            )
-            outputs.append(
-                ToolMessage(
-                    content=tool_result,
-                    # content=json.dumps(tool_result),
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"],
-                )
+            tool = self.tools_by_name[tool_call["name"]]
+            # Injected arguments that live in the graph state (e.g. retrieved docs) are
+            # passed by reference here instead of being copied into the tool call.
+            injected = {
+                name: getattr(inputs, name)
+                for name in tool.args
+                if name not in tool.tool_call_schema.model_fields
+                and name not in tool_call["args"]
+                and hasattr(inputs, name)
+            }
+            # Invoking with the whole tool call returns a ToolMessage that keeps the
+            # artifact of `content_and_artifact` tools.
+            tool_message = await tool.ainvoke(
+                {
+                    **tool_call,
+                    "args": {**tool_call["args"], **injected},
+                    "type": "tool_call",
+                }
             )
+            outputs.append(tool_message)
         return {"messages": outputs}
 
 
-@tool("retrieve_tool")
+@tool("retrieve_tool", response_format="content_and_artifact")
 async def retrieve(
     question: str,
-    knowledge_name: Annotated[str, InjectedToolArg],
+    knowledge_names: Annotated[list[str], InjectedToolArg],
     user_id: Annotated[str, InjectedToolArg],
-) -> list[Document]:
+    speculation: Annotated[Speculation | None, InjectedToolArg] = None,
+) -> tuple[str, list[Document]]:
     """
     This tool takes question as input and returns the relevant documents.
     Args:
         question: str
-        knowledge_name: str
+        knowledge_names: list[str]
         user_id: str
     Returns:
         list[Document]
     """
-    from backend import get_vs_path, EMBED_MODEL
+    from retrieval import retrieve_with_speculation
 
     logger.info("Retrieve Tool Triggered")
-    faiss_path = get_vs_path(knowledge_name=knowledge_name, user_id=user_id)
-    vectorstore = FAISS.load_local(
-        faiss_path, EMBED_MODEL, allow_dangerous_deserialization=True
+    results = await retrieve_with_speculation(
+        user_id=user_id,
+        knowledge_names=knowledge_names,
+        question=question,
+        speculation=speculation,
     )
-    results = vectorstore.similarity_search(question, k=5)
 
-    return results
+    # The documents travel as the message artifact, only a short summary goes into
+    # the conversation.
+    return describe_docs(results), results
 
 
 @tool("query_tool")
 async def query(
     question: str,
-    knowledge_name: Annotated[str, InjectedToolArg],
+    knowledge_names: Annotated[list[str], InjectedToolArg],
     user_id: Annotated[str, InjectedToolArg],
     docs: Annotated[list[Document], InjectedToolArg],
 ) -> str:
@@ -88,24 +101,24 @@ async def query(
     This tool takes question as input and returns the answer solely based on the retrieved docs.
     Args:
         question: str
-        knowledge_name: str
+        knowledge_names: list[str]
         user_id: str
         docs: list[Document]
     Returns:
         String
     """
-    from ask_graph import build_ask_graph
+    from ask_graph import get_ask_graph
 
     logger.info("Query Tool Triggered")
-    ask_graph = build_ask_graph()
+    ask_graph = get_ask_graph()
     config = RunnableConfig(
         configurable={
-            "thread_id": f"{user_id}_{knowledge_name}_ask",
+            "thread_id": f"{user_id}_{','.join(knowledge_names)}_ask",
         }
     )
     response = await ask_graph.ainvoke(
         {
-            "knowledge_name": knowledge_name,
+            "knowledge_names": knowledge_names,
             "question": question,
             "user_id": user_id,
             "docs": docs,
@@ -129,15 +142,7 @@ async def search(
     """
     logger.info("Search Tool Triggered")
     search_results = tavily_client.search(question)
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
-    )
-    if model is None:
-        raise RuntimeError("Model not available ")
-    response = await model.ainvoke(
+    response = await get_llm("search").ainvoke(
         SEARCH_PROMPT.format(question=question, results=search_results)
     )
     return str(response.content)
@@ -146,7 +151,7 @@ async def search(
 @tool("summarizer_tool")
 async def summarizer(
     question: str,
-    knowledge_name: Annotated[str, InjectedToolArg],
+    knowledge_names: Annotated[list[str], InjectedToolArg],
     user_id: Annotated[str, InjectedToolArg],
 ) -> str:
     """
@@ -156,46 +161,41 @@ async def summarizer(
     Returns:
         String
     """
-    from backend import get_docs_path
+    from backend import get_docs_path, get_summaries_path, get_text_store_path
+    from summaries import answer_from_summaries, load_summaries, refresh_summaries
 
     logger.info("Summarizer Tool Triggered")
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
+    knowledge_names = [
+        knowledge_name
+        for knowledge_name in knowledge_names
+        if os.path.isdir(get_docs_path(knowledge_name=knowledge_name, user_id=user_id))
+    ]
+    # Per-document summaries are normally computed at index time, this only
+    # summarizes files uploaded or changed since.
+    await asyncio.gather(
+        *(
+            refresh_summaries(
+                get_docs_path(knowledge_name=knowledge_name, user_id=user_id),
+                get_summaries_path(knowledge_name=knowledge_name, user_id=user_id),
+                get_text_store_path(knowledge_name=knowledge_name, user_id=user_id),
+            )
+            for knowledge_name in knowledge_names
+        )
     )
-    if model is None:
-        raise RuntimeError("Model not available ")
-    docs_path = get_docs_path(knowledge_name=knowledge_name, user_id=user_id)
-
-    all_files = os.listdir(docs_path)
-    pdf_files = [f for f in all_files if f.lower().endswith(".pdf")]
-
-    if not pdf_files:
+    summaries: dict[str, str] = {}
+    for knowledge_name in knowledge_names:
+        stored = load_summaries(
+            get_summaries_path(knowledge_name=knowledge_name, user_id=user_id)
+        )
+        for file_name, entry in stored.items():
+            if len(knowledge_names) > 1:
+                file_name = f"{knowledge_name}/{file_name}"
+            summaries[file_name] = entry["summary"]
+
+    if not summaries:
         return str("No PDF files found.")
 
-    all_pages = []
-
-    for pdf in pdf_files:
-        pdf_full_path = os.path.join(docs_path, pdf)
-
-        try:
-            doc = fitz.open(pdf_full_path)
-        except Exception as e:
-            logger.error(f"Error opening {pdf}: {e}")
-            continue
-
-        for i in range(len(doc)):
-            text = doc[i].get_text()
-            all_pages.append(
-                Document(page_content=text, metadata={"page": i + 1, "file_name": pdf})
-            )
-
-    response = await model.ainvoke(
-        SUMMARIZER_PROMPT.format(question=question, docs=all_pages)
-    )
-    return str(response.content)
+    return await answer_from_summaries(question, summaries)
 
 
 @tool("doc_related_tool")
@@ -211,17 +211,9 @@ async def doc_related(
         String
     """
     logger.info("Doc related Tool Triggered")
-    model = ChatOpenAI(
-        model=settings.models_settings.MODEL_NAME,
-        temperature=settings.models_settings.TEMPERATURE,
-        base_url=settings.models_settings.BASE_URL,
-        api_key=settings.models_settings.API_KEY,  # type:ignore
-    )
-    if model is None:
-        raise RuntimeError("Model not available ")
-    response = await model.ainvoke(
-        SEARCH_PROMPT.format(question=question, results=docs)
-    )
+    prompt = SEARCH_PROMPT.format(question=question, results=format_docs(docs))
+    response = await get_llm("doc_related").ainvoke(prompt)
+    observe_llm_usage("doc_related", prompt, response)
     return str(response.content)
 
 
@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any
+
+import faiss  # type:ignore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from ann import IndexType, set_search_params
+from bm25 import BM25Index
+from docstores import SQLiteDocstore, SQLiteIndexMapping
+from exact_vectors import ExactVectorStore
+from logger import logger
+from metrics import metrics
+from settings import settings
+
+VERSION_FILE_NAME = "version"
+META_FILE_NAME = "meta.json"
+INDEX_FILE_NAME = "index.faiss"
+PICKLE_FILE_NAME = "index.pkl"
+DOCSTORE_FILE_NAME = "docstore.sqlite"
+DOCSTORE_COPY_BATCH_SIZE = 1000
+
+
+class StorageMode(StrEnum):
+    PICKLE = "pickle"
+    MMAP = "mmap"
+
+
+def read_vectorstore_meta(vs_path: str) -> dict[str, Any]:
+    try:
+        with open(os.path.join(vs_path, META_FILE_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Stores written before the metadata file existed are pickled flat indexes.
+        return {"storage_mode": StorageMode.PICKLE}
+
+
+def write_vectorstore_meta(vs_path: str, meta: dict[str, Any]) -> None:
+    tmp_path = os.path.join(vs_path, f"{META_FILE_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(vs_path, META_FILE_NAME))
+
+
+def search_params(meta: dict[str, Any]) -> dict[str, int]:
+    """Search-time parameters stored with the index, overridden by retrieval settings."""
+    params = dict(meta.get("index_params", {}))
+    if settings.retrieval_settings.NPROBE:
+        params["nprobe"] = settings.retrieval_settings.NPROBE
+    if settings.retrieval_settings.EF_SEARCH:
+        params["efSearch"] = settings.retrieval_settings.EF_SEARCH
+    return params
+
+
+def mapped_bytes(index: Any) -> int:
+    """Bytes of a memory-mapped index that live in the OS page cache rather than the heap."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        invlists = faiss.downcast_InvertedLists(ivf.invlists)
+        if not isinstance(invlists, faiss.OnDiskInvertedLists):
+            return 0
+        # Codes plus one 64-bit ID per stored vector.
+        return ivf.ntotal * (ivf.code_size + 8)
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        return storage.ntotal * storage.code_size + index.hnsw.neighbors.size() * 4
+    return index.ntotal * index.code_size
+
+
+def read_mapped_index(index_path: str, index_type: IndexType) -> tuple[Any, int]:
+    """
+    Reads an index for read-only use with its largest arrays memory-mapped: the inverted
+    lists of IVF indexes, the codes (and graph) of flat and HNSW indexes. Falls back to a
+    regular load when the index cannot be mapped. Returns the index and the bytes it still
+    holds on the heap.
+    """
+    # Search never uses the symmetric PQ distance table, only adding vectors does.
+    flags = faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_PQ_SKIP_SDC_TABLE
+    flags |= (
+        faiss.IO_FLAG_MMAP if index_type == IndexType.IVF else faiss.IO_FLAG_MMAP_IFC
+    )
+    file_size = os.path.getsize(index_path)
+    try:
+        index = faiss.read_index(index_path, flags)
+    except RuntimeError as e:
+        logger.warning(f"Could not memory-map {index_path}, loading it instead: {e}")
+        metrics.increment("vectorstore.mmap_fallbacks")
+        return faiss.read_index(index_path), file_size
+    return index, max(0, file_size - mapped_bytes(index))
+
+
+def load_vectorstore(vs_path: str, embeddings: Embeddings, read_only: bool) -> FAISS:
+    """
+    Loads a vector store in whatever storage mode it was saved with. Read-only loads of
+    `mmap` stores memory-map the FAISS index and query the SQLite docstore in place,
+    so many workers share the same physical pages. Writable loads work on a private
+    copy of the docstore that `save_vectorstore` swaps in atomically.
+    """
+    return load_vectorstore_sized(vs_path, embeddings, read_only)[0]
+
+
+def load_vectorstore_sized(
+    vs_path: str, embeddings: Embeddings, read_only: bool
+) -> tuple[FAISS, int]:
+    """`load_vectorstore` that also returns the bytes the loaded store holds on the heap."""
+    meta = read_vectorstore_meta(vs_path)
+    if StorageMode(meta["storage_mode"]) == StorageMode.PICKLE:
+        store = FAISS.load_local(
+            vs_path, embeddings, allow_dangerous_deserialization=True
+        )
+        set_search_params(store.index, search_params(meta))
+        return store, in_memory_size(vs_path)
+
+    index_path = os.path.join(vs_path, INDEX_FILE_NAME)
+    docstore_path = os.path.join(vs_path, DOCSTORE_FILE_NAME)
+    if read_only:
+        index, size_bytes = read_mapped_index(
+            index_path, IndexType(meta.get("resolved_index_type", IndexType.FLAT))
+        )
+        set_search_params(index, search_params(meta))
+        docstore = SQLiteDocstore(docstore_path, read_only=True)
+        store = FAISS(embeddings, index, docstore, SQLiteIndexMapping(docstore))  # type:ignore
+        return store, size_bytes
+
+    working_path = f"{docstore_path}.tmp"
+    shutil.copyfile(docstore_path, working_path)
+    docstore = SQLiteDocstore(working_path)
+    store = FAISS(
+        embeddings,
+        faiss.read_index(index_path),
+        docstore,
+        docstore.read_index_mapping(),
+    )
+    return store, os.path.getsize(index_path)
+
+
+def _to_in_memory(store: FAISS) -> None:
+    if isinstance(store.docstore, InMemoryDocstore):
+        return
+    mapping = dict(store.index_to_docstore_id)
+    docs = {doc_id: store.docstore.search(doc_id) for doc_id in mapping.values()}
+    if isinstance(store.docstore, SQLiteDocstore):
+        store.docstore.close()
+        os.remove(store.docstore.path)
+    store.docstore = InMemoryDocstore(docs)  # type:ignore
+    store.index_to_docstore_id = mapping
+
+
+def _to_sqlite(store: FAISS, working_path: str) -> SQLiteDocstore:
+    docstore = store.docstore
+    if isinstance(docstore, SQLiteDocstore) and docstore.path == working_path:
+        return docstore
+    if os.path.exists(working_path):
+        os.remove(working_path)
+    sqlite_docstore = SQLiteDocstore(working_path)
+    doc_ids = list(store.index_to_docstore_id.values())
+    for start in range(0, len(doc_ids), DOCSTORE_COPY_BATCH_SIZE):
+        batch = doc_ids[start : start + DOCSTORE_COPY_BATCH_SIZE]
+        sqlite_docstore.add({doc_id: docstore.search(doc_id) for doc_id in batch})  # type:ignore
+    return sqlite_docstore
+
+
+def save_vectorstore(
+    store: FAISS,
+    vs_path: str,
+    storage_mode: StorageMode,
+    meta: dict[str, Any] | None = None,
+) -> None:
+    os.makedirs(vs_path, exist_ok=True)
+    docstore_path = os.path.join(vs_path, DOCSTORE_FILE_NAME)
+    pickle_path = os.path.join(vs_path, PICKLE_FILE_NAME)
+
+    if storage_mode == StorageMode.PICKLE:
+        _to_in_memory(store)
+        store.save_local(vs_path)
+        if os.path.exists(docstore_path):
+            os.remove(docstore_path)
+    else:
+        # Both files are written next to the live ones and swapped in with os.replace,
+        # readers that still map the previous files keep a consistent snapshot.
+        index_path = os.path.join(vs_path, INDEX_FILE_NAME)
+        faiss.write_index(store.index, f"{index_path}.tmp")
+        docstore = _to_sqlite(store, f"{docstore_path}.tmp")
+        docstore.write_index_mapping(store.index_to_docstore_id)
+        docstore.close()
+        os.replace(f"{docstore_path}.tmp", docstore_path)
+        os.replace(f"{index_path}.tmp", index_path)
+        if os.path.exists(pickle_path):
+            os.remove(pickle_path)
+
+    write_vectorstore_meta(
+        vs_path,
+        {
+            **read_vectorstore_meta(vs_path),
+            **(meta or {}),
+            "storage_mode": storage_mode,
+        },
+    )
+
+
+def write_index_version(vs_path: str) -> str:
+    version = uuid.uuid4().hex
+    tmp_path = os.path.join(vs_path, f"{VERSION_FILE_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(vs_path, VERSION_FILE_NAME))
+    return version
+
+
+def read_index_version(vs_path: str) -> str | None:
+    try:
+        with open(os.path.join(vs_path, VERSION_FILE_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def in_memory_size(vs_path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(vs_path, file_name))
+        for file_name in (INDEX_FILE_NAME, PICKLE_FILE_NAME)
+        if os.path.exists(os.path.join(vs_path, file_name))
+    )
+
+
+def close_stores(
+    docstore: Any, lexical: BM25Index | None, exact: ExactVectorStore | None
+) -> None:
+    if isinstance(docstore, SQLiteDocstore):
+        docstore.close()
+    if lexical is not None:
+        lexical.close()
+    if exact is not None:
+        exact.close()
+
+
+@dataclass
+class CachedVectorStore:
+    store: FAISS
+    lexical: BM25Index | None
+    exact: ExactVectorStore | None
+    version: str | None
+    size_bytes: int
+
+
+class VectorStoreCache:
+    """
+    Process-wide LRU cache of loaded FAISS vector stores keyed by `(user_id, knowledge_name)`.
+    An entry is reloaded when the version file written by the indexer changes, and the
+    least recently used entries are evicted once the heap size of the cached stores
+    exceeds `max_bytes`. Pickled stores count their whole file size, memory-mapped ones
+    only the parts of the index that could not be mapped.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple[str, str], CachedVectorStore] = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks: dict[tuple[str, str], threading.Lock] = {}
+        self.load_waiters: Counter[tuple[str, str]] = Counter()
+
+    def get(
+        self, key: tuple[str, str], vs_path: str, embeddings: Embeddings
+    ) -> CachedVectorStore:
+        version = read_index_version(vs_path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.version == version:
+                self.entries.move_to_end(key)
+                metrics.increment("vectorstore_cache.hits")
+                return entry
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+            self.load_waiters[key] += 1
+
+        try:
+            return self._load(key, vs_path, embeddings, version, load_lock)
+        finally:
+            with self.lock:
+                self.load_waiters[key] -= 1
+                if not self.load_waiters[key]:
+                    del self.load_waiters[key]
+                    del self.load_locks[key]
+
+    def _load(
+        self,
+        key: tuple[str, str],
+        vs_path: str,
+        embeddings: Embeddings,
+        version: str | None,
+        load_lock: threading.Lock,
+    ) -> CachedVectorStore:
+        # Only one thread loads a given store, the others wait and reuse its result.
+        with load_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry.version == version:
+                    self.entries.move_to_end(key)
+                    metrics.increment("vectorstore_cache.hits")
+                    return entry
+
+            metrics.increment("vectorstore_cache.misses")
+            with metrics.timer("vectorstore_cache.load"):
+                store, size_bytes = load_vectorstore_sized(
+                    vs_path, embeddings, read_only=True
+                )
+            lexical = BM25Index.open(vs_path)
+            exact = ExactVectorStore.open(vs_path)
+            # Searches still running on a dropped entry hold the store, its connections
+            # are closed once the last of them lets go.
+            weakref.finalize(store, close_stores, store.docstore, lexical, exact)
+            entry = CachedVectorStore(
+                store=store,
+                lexical=lexical,
+                exact=exact,
+                version=version,
+                size_bytes=size_bytes,
+            )
+            with self.lock:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                self._evict()
+            return entry
+
+    async def aget(
+        self, key: tuple[str, str], vs_path: str, embeddings: Embeddings
+    ) -> CachedVectorStore:
+        return await asyncio.to_thread(self.get, key, vs_path, embeddings)
+
+    def invalidate(self, key: tuple[str, str]) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _evict(self) -> None:
+        total = sum(entry.size_bytes for entry in self.entries.values())
+        # The most recently used entry is always kept, even if it alone exceeds the budget.
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            total -= entry.size_bytes
+            metrics.increment("vectorstore_cache.evictions")
+            logger.info(f"Evicted vectorstore {key} from cache")